@@ -6,23 +6,38 @@ Implements safety guardrails, PII detection, priority-based escalation,
 and human-in-the-loop oversight mechanisms.
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Response, Request
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+from sqlalchemy import case, exists, func, select
+from sqlalchemy.orm import Session, aliased
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timezone
+from functools import lru_cache
+import orjson
+from bisect import bisect_right
+import asyncio
 import re
+import threading
+import time
 
 # Import database and auth
-from database import get_db, init_db, User, Conversation, Message, ModeratorDecision
+from database import (
+    get_db,
+    init_db,
+    User,
+    Conversation,
+    Message,
+    ModeratorDecision,
+)
 from auth import (
     get_current_user,
     create_access_token,
     get_password_hash,
-    verify_password,
+    verify_and_update_password,
     get_or_create_anonymous_session,
 )
 
@@ -37,6 +52,8 @@ app = FastAPI(
     title="AI Safety Chat API",
     description="Backend API for AI Safety Chat with safety guardrails",
     version="2.0.0",
+    # Serialize every JSON response with orjson instead of the stdlib encoder
+    default_response_class=ORJSONResponse,
 )
 
 # CORS configuration
@@ -48,7 +65,8 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins for development (including 'null')
     allow_credentials=False,  # Set to False to allow wildcard origins
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "HEAD"],
+    # CORSMiddleware answers every preflight itself, so no OPTIONS routes needed
+    allow_methods=["*"],
     allow_headers=[
         "Content-Type",
         "Authorization",
@@ -65,56 +83,6 @@ app.add_middleware(
 )
 
 
-# Add middleware to explicitly set CORS headers for all responses (including 'null' origin)
-@app.middleware("http")
-async def add_cors_headers(request: Request, call_next):
-    """Add CORS headers to all responses, including handling 'null' origin"""
-    response = await call_next(request)
-    # Explicitly set CORS headers for all responses
-    response.headers["Access-Control-Allow-Origin"] = (
-        "*"  # Allow all origins including 'null'
-    )
-    response.headers["Access-Control-Allow-Methods"] = (
-        "GET, POST, PUT, DELETE, OPTIONS, PATCH, HEAD"
-    )
-    response.headers["Access-Control-Allow-Headers"] = (
-        "Content-Type, Authorization, Accept, Origin, X-Requested-With, Access-Control-Request-Method, Access-Control-Request-Headers"
-    )
-    response.headers["Access-Control-Allow-Credentials"] = "false"
-    response.headers["Access-Control-Expose-Headers"] = "*"
-    return response
-
-
-# Add explicit OPTIONS handler for /chat endpoint to ensure preflight works
-@app.options("/chat")
-async def options_chat():
-    """Handle OPTIONS preflight for /chat endpoint"""
-    return Response(
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization, Accept, Origin",
-            "Access-Control-Max-Age": "3600",
-        },
-    )
-
-
-# Add OPTIONS handler for all other endpoints too
-@app.options("/{full_path:path}")
-async def options_handler(full_path: str):
-    """Handle OPTIONS preflight for all endpoints"""
-    return Response(
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization, Accept, Origin, X-Requested-With",
-            "Access-Control-Max-Age": "3600",
-        },
-    )
-
-
 # Safety keywords (same as frontend)
 SAFETY_KEYWORDS = {
     "medical": ["pain", "hurt", "fever", "doctor", "medicine", "sick", "headache"],
@@ -142,11 +110,175 @@ SAFETY_KEYWORDS = {
     ],
 }
 
+# Lowercased keywords per category, for checks against a single category
+SAFETY_KEYWORDS_LOWER = {
+    category: tuple(keyword.lower() for keyword in keywords)
+    for category, keywords in SAFETY_KEYWORDS.items()
+}
+
+# Flattened (keyword, category) table built once at import so a message can be
+# matched against every category in a single pass
+# NOTE: Keywords match as substrings ("stocks", "investment", "doctors"), so
+# this stays a substring scan rather than a token-set intersection, which
+# would miss inflected forms and measured slower on typical messages
+SAFETY_KEYWORD_TABLE = tuple(
+    (keyword.lower(), category)
+    for category, keywords in SAFETY_KEYWORDS.items()
+    for keyword in keywords
+)
+
+# Crisis keywords shared by the safety filter, priority calculation and
+# response generation
+CRISIS_KEYWORDS = SAFETY_KEYWORDS_LOWER["crisis"]
+
+# PII detection patterns, fused into a single alternation so each message is
+# scanned once. Entries are (group name, PII type, pattern); at any position the
+# alternatives are tried in this order. Every pattern starts at a word boundary,
+# which is factored out so non-boundary positions are rejected immediately.
+PII_PATTERN_PARTS = [
+    # Credit cards: 4111-1111-1111-1111, 4111 1111 1111 1111
+    # Both card patterns fix the digit count (16 and 15), so matches are always
+    # within the 13-19 digit card range and need no separate digit count
+    ("credit_card", "credit_card", r"\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b"),
+    # Amex: 3782-822463-10005
+    ("credit_card_amex", "credit_card", r"\d{4}[-\s]?\d{6}[-\s]?\d{5}\b"),
+    # SSN: XXX-XX-XXXX
+    ("ssn", "ssn", r"\d{3}-\d{2}-\d{4}\b"),
+    # Bare 10-digit numbers only count as phones with phone-related context,
+    # to avoid matching years, timestamps, etc. Only the digits are redacted.
+    (
+        "phone_context",
+        "phone",
+        (
+            r"(?i:(?:phone|call|text|contact|number|tel|mobile)\s*[:\-]?\s*)"
+            r"(?P<phone_context_number>\d{10})\b"
+        ),
+    ),
+    ("phone_parens", "phone", r"\(\d{3}\)\s*\d{3}-\d{4}\b"),  # (123) 456-7890
+    ("phone_dashes", "phone", r"\d{3}-\d{3}-\d{4}\b"),  # 123-456-7890
+    ("phone_dots", "phone", r"\d{3}\.\d{3}\.\d{4}\b"),  # 123.456.7890
+    (
+        "phone_international",
+        "phone",
+        r"\+\d{1,3}\s*\d{3}\s*\d{3}\s*\d{4}\b",
+    ),  # +1 123 456 7890
+    ("phone_spaces", "phone", r"\d{3}\s+\d{3}\s+\d{4}\b"),  # 123 456 7890
+    ("email", "email", r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"),
+    # Physical addresses (basic pattern - street number + street name)
+    (
+        "address",
+        "address",
+        (
+            r"(?i:\d+\s+[A-Za-z\s]+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln"
+            r"|Boulevard|Blvd|Way|Circle|Cir)\b)"
+        ),
+    ),
+    # Any other bare 10-digit number - tried last, and only redacted once
+    # phone context appears somewhere in the message
+    ("phone_bare", "phone", r"\d{10}\b"),
+]
+PII_PATTERN = re.compile(
+    r"\b(?:"
+    + "|".join(f"(?P<{name}>{pattern})" for name, _, pattern in PII_PATTERN_PARTS)
+    + ")"
+)
+PII_GROUP_TYPES = {name: pii_type for name, pii_type, _ in PII_PATTERN_PARTS}
+# Order in which detected PII types are reported
+PII_TYPES = ("credit_card", "ssn", "phone", "email", "address")
+# Every PII pattern needs a digit or "@", so text without either has no PII
+PII_CHAR_PATTERN = re.compile(r"[\d@]")
+
+# Simple arithmetic expression (e.g. "2+2", "3 * 3")
+MATH_PATTERN = re.compile(r"\d+\s*[+\-*/×÷]\s*\d+")
+
+# Longest chat message accepted, in characters
+MAX_MESSAGE_LENGTH = 4096
+
 # OpenAI API key (optional)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 USE_OPENAI = bool(OPENAI_API_KEY)
 
 
+# Immediate crisis resources, returned whenever crisis content is detected
+CRISIS_RESPONSE = (
+    "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
+    "**Crisis Resources:**\n"
+    "• National Suicide Prevention Lifeline: 988 (24/7)\n"
+    "• Crisis Text Line: Text HOME to 741741\n"
+    "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
+    "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
+)
+
+# Mock responses for personal information and flagged categories
+MOCK_PII_RESPONSE = "I've detected personal information in your message. For privacy protection, I've redacted it. Remember: AI systems should never ask for or store personal details like emails, passwords, or identification numbers."
+MOCK_CATEGORY_RESPONSES = {
+    "medical": "I understand you mentioned medical-related topics. In a production AI system, medical queries would typically be flagged for review to ensure accurate, safe information. This educational system demonstrates how such content is identified and would be handled with appropriate guardrails and potentially human medical professional oversight.",
+    "financial": "I notice financial-related keywords in your message. Financial advice requires careful consideration and often regulatory compliance. In production systems, such queries would be flagged for review to ensure responsible handling. This demonstrates how AI safety systems identify and manage sensitive financial content.",
+    "legal": "Your message contains legal-related terms. Legal matters often require professional expertise and careful handling. In a production AI system, legal queries would be flagged for review to ensure appropriate responses. This educational system shows how such content is identified for safety oversight.",
+}
+
+# Mock responses for common topics, checked in order once the PII, crisis and
+# category branches have been ruled out. Each rule is (keywords, response) and
+# fires when every keyword appears in the lowercased message.
+MOCK_SAFETY_RESPONSE = "Great question! AI safety involves implementing guardrails to ensure AI systems behave responsibly. This includes content filtering, bias detection, and human oversight mechanisms. In this educational system, we're demonstrating how such guardrails can work in practice."
+MOCK_BIAS_RESPONSE = "Bias in AI is a critical safety concern. AI systems can perpetuate or amplify biases present in training data. Safety measures include diverse datasets, fairness audits, and continuous monitoring. This is why human-in-the-loop oversight is essential."
+MOCK_RISK_RESPONSE = "AI risks can include misinformation, privacy violations, and unintended harmful outputs. Safety systems use multiple layers: input validation, output filtering, and human review processes. Education about these risks is the first step toward safer AI."
+MOCK_GREETING_RESPONSE = "Hello! I'm here to help you learn about AI safety. Feel free to ask me about guardrails, bias, risks, or any other AI safety topics. Remember, this is an educational demonstration."
+MOCK_ADDITION_RESPONSE = (
+    "2 + 2 equals 4. This is a basic mathematical fact with 100% certainty."
+)
+MOCK_MULTIPLICATION_RESPONSE = (
+    "3 times 3 equals 9. This is a basic mathematical fact with 100% certainty."
+)
+MOCK_SUBTRACTION_RESPONSE = (
+    "10 minus 5 equals 5. This is a basic mathematical fact with 100% certainty."
+)
+MOCK_FRANCE_RESPONSE = "Paris is the capital of France. This is a well-established geographical fact with 100% certainty."
+MOCK_JAPAN_RESPONSE = "Tokyo is the capital of Japan. This is a well-established geographical fact with 100% certainty."
+MOCK_WATER_RESPONSE = "Water boils at 100 degrees Celsius (212 degrees Fahrenheit) at standard atmospheric pressure. This is a well-established scientific fact with 100% certainty."
+MOCK_EARTH_RESPONSE = "Earth orbits the Sun. This is a well-established astronomical fact with 100% certainty."
+MOCK_PHOTOSYNTHESIS_RESPONSE = "Photosynthesis is the process by which plants convert light energy into chemical energy, using carbon dioxide and water to produce glucose and oxygen. This is a well-documented scientific process that AI systems can explain with high confidence."
+MOCK_INVESTMENT_RESPONSE = "I cannot provide specific investment advice, as financial decisions require professional expertise and depend on individual circumstances. In a production AI system, such queries would be flagged for review to ensure responsible handling. This demonstrates how AI safety systems identify and manage sensitive financial content."
+MOCK_FUTURE_JOBS_RESPONSE = "Predicting the future impact of AI on jobs involves many uncertain factors. While AI will likely change the job market, the exact outcomes depend on various economic, social, and technological developments that are difficult to predict with certainty. This type of speculative question would be flagged for lower confidence in an AI safety system."
+MOCK_WEATHER_RESPONSE = "I don't have access to real-time weather data, so I cannot provide current weather information. Weather queries require up-to-date data from meteorological services, which would be flagged as medium confidence in an AI safety system."
+
+MOCK_RESPONSE_RULES = [
+    (("safety",), MOCK_SAFETY_RESPONSE),
+    (("guardrail",), MOCK_SAFETY_RESPONSE),
+    (("bias",), MOCK_BIAS_RESPONSE),
+    (("fair",), MOCK_BIAS_RESPONSE),
+    (("risk",), MOCK_RISK_RESPONSE),
+    (("danger",), MOCK_RISK_RESPONSE),
+    (("hello",), MOCK_GREETING_RESPONSE),
+    (("hi",), MOCK_GREETING_RESPONSE),
+    (("hey",), MOCK_GREETING_RESPONSE),
+    # Simple factual questions - answer directly (100% confidence facts)
+    (("2+2",), MOCK_ADDITION_RESPONSE),
+    (("2 + 2",), MOCK_ADDITION_RESPONSE),
+    (("3*3",), MOCK_MULTIPLICATION_RESPONSE),
+    (("3 * 3",), MOCK_MULTIPLICATION_RESPONSE),
+    (("3 times 3",), MOCK_MULTIPLICATION_RESPONSE),
+    (("10-5",), MOCK_SUBTRACTION_RESPONSE),
+    (("10 - 5",), MOCK_SUBTRACTION_RESPONSE),
+    (("capital", "france"), MOCK_FRANCE_RESPONSE),
+    (("france capital",), MOCK_FRANCE_RESPONSE),
+    (("capital", "japan"), MOCK_JAPAN_RESPONSE),
+    (("japan capital",), MOCK_JAPAN_RESPONSE),
+    (("water boils",), MOCK_WATER_RESPONSE),
+    (("boiling point of water",), MOCK_WATER_RESPONSE),
+    (("earth orbits",), MOCK_EARTH_RESPONSE),
+    (("earth revolves around sun",), MOCK_EARTH_RESPONSE),
+    (("photosynthesis", "explain"), MOCK_PHOTOSYNTHESIS_RESPONSE),
+    (("photosynthesis", "what is"), MOCK_PHOTOSYNTHESIS_RESPONSE),
+    # Financial - safety disclaimer first, then answer if possible
+    (("invest",), MOCK_INVESTMENT_RESPONSE),
+    (("stock", "should"), MOCK_INVESTMENT_RESPONSE),
+    (("will", "ai"), MOCK_FUTURE_JOBS_RESPONSE),
+    (("will", "job"), MOCK_FUTURE_JOBS_RESPONSE),
+    (("weather",), MOCK_WEATHER_RESPONSE),
+]
+
+
 # Mock OpenAI client for when API key is not provided
 class MockOpenAI:
     """Mock OpenAI client for demonstration"""
@@ -156,157 +288,72 @@ class MockOpenAI:
         user_message: str,
         category: Optional[str] = None,
         pii_types: Optional[List[str]] = None,
+        lower_message: Optional[str] = None,
+        is_crisis: Optional[bool] = None,
     ) -> str:
-        """Generate a mock AI response"""
-        lower_message = user_message.lower()
+        """
+        Generate a mock AI response
+
+        is_crisis skips the crisis keyword scan when the caller already ran it
+        """
+        lower_message = lower_message or user_message.lower()
 
         # Handle PII detection first - provide educational privacy response
-        if pii_types and len(pii_types) > 0:
-            # Use a clear, educational response that matches the example format
-            return "I've detected personal information in your message. For privacy protection, I've redacted it. Remember: AI systems should never ask for or store personal details like emails, passwords, or identification numbers."
-
-        # CRISIS CONTENT: Check content FIRST (before category check) to catch all cases
-        crisis_keywords_direct = [
-            "i want to die",
-            "want to die",
-            "kill myself",
-            "end my life",
-            "suicide",
-            "suicidal",
-            "don't want to live",
-            "better off dead",
-            "going to kill",
-            "end it all",
-            "no reason to live",
-            "hurt myself",
-            "self harm",
-            "cutting myself",
-            "not worth living",
-        ]
-        for keyword in crisis_keywords_direct:
-            if keyword in lower_message:
-                # Crisis detected - return immediate resources
-                crisis_response = (
-                    "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
-                    "**Crisis Resources:**\n"
-                    "• National Suicide Prevention Lifeline: 988 (24/7)\n"
-                    "• Crisis Text Line: Text HOME to 741741\n"
-                    "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
-                    "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
-                )
-                return crisis_response
-
-        # CRISIS CONTENT: Also check category (backup)
-        if category == "crisis":
-            crisis_response = (
-                "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
-                "**Crisis Resources:**\n"
-                "• National Suicide Prevention Lifeline: 988 (24/7)\n"
-                "• Crisis Text Line: Text HOME to 741741\n"
-                "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
-                "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
-            )
-            return crisis_response
-
-        if category == "medical":
-            return "I understand you mentioned medical-related topics. In a production AI system, medical queries would typically be flagged for review to ensure accurate, safe information. This educational system demonstrates how such content is identified and would be handled with appropriate guardrails and potentially human medical professional oversight."
-        elif category == "financial":
-            return "I notice financial-related keywords in your message. Financial advice requires careful consideration and often regulatory compliance. In production systems, such queries would be flagged for review to ensure responsible handling. This demonstrates how AI safety systems identify and manage sensitive financial content."
-        elif category == "legal":
-            return "Your message contains legal-related terms. Legal matters often require professional expertise and careful handling. In a production AI system, legal queries would be flagged for review to ensure appropriate responses. This educational system shows how such content is identified for safety oversight."
-        # Crisis category already handled above - this should never be reached
-        elif "safety" in lower_message or "guardrail" in lower_message:
-            return "Great question! AI safety involves implementing guardrails to ensure AI systems behave responsibly. This includes content filtering, bias detection, and human oversight mechanisms. In this educational system, we're demonstrating how such guardrails can work in practice."
-        elif "bias" in lower_message or "fair" in lower_message:
-            return "Bias in AI is a critical safety concern. AI systems can perpetuate or amplify biases present in training data. Safety measures include diverse datasets, fairness audits, and continuous monitoring. This is why human-in-the-loop oversight is essential."
-        elif "risk" in lower_message or "danger" in lower_message:
-            return "AI risks can include misinformation, privacy violations, and unintended harmful outputs. Safety systems use multiple layers: input validation, output filtering, and human review processes. Education about these risks is the first step toward safer AI."
-        elif (
-            "hello" in lower_message or "hi" in lower_message or "hey" in lower_message
-        ):
-            return "Hello! I'm here to help you learn about AI safety. Feel free to ask me about guardrails, bias, risks, or any other AI safety topics. Remember, this is an educational demonstration."
-        # Simple factual questions - answer directly first (100% confidence facts)
-        elif (
-            "2+2" in lower_message
-            or "what is 2+2" in lower_message
-            or lower_message.strip() == "2+2"
-            or "2 + 2" in lower_message
-        ):
-            return (
-                "2 + 2 equals 4. This is a basic mathematical fact with 100% certainty."
-            )
-        elif (
-            "3*3" in lower_message
-            or "3 * 3" in lower_message
-            or "3 times 3" in lower_message
-            or "what is 3*3" in lower_message
-        ):
-            return "3 times 3 equals 9. This is a basic mathematical fact with 100% certainty."
-        elif (
-            "10-5" in lower_message
-            or "10 - 5" in lower_message
-            or "what is 10-5" in lower_message
-        ):
-            return "10 minus 5 equals 5. This is a basic mathematical fact with 100% certainty."
-        elif (
-            ("capital" in lower_message and "france" in lower_message)
-            or lower_message.strip() == "capital of france"
-            or "france capital" in lower_message
-        ):
-            return "Paris is the capital of France. This is a well-established geographical fact with 100% certainty."
-        elif (
-            "capital" in lower_message and "japan" in lower_message
-        ) or "japan capital" in lower_message:
-            return "Tokyo is the capital of Japan. This is a well-established geographical fact with 100% certainty."
-        elif (
-            "water boils" in lower_message or "boiling point of water" in lower_message
-        ):
-            return "Water boils at 100 degrees Celsius (212 degrees Fahrenheit) at standard atmospheric pressure. This is a well-established scientific fact with 100% certainty."
-        elif (
-            "earth orbits" in lower_message
-            or "earth revolves around sun" in lower_message
-        ):
-            return "Earth orbits the Sun. This is a well-established astronomical fact with 100% certainty."
-        elif "photosynthesis" in lower_message and (
-            "explain" in lower_message or "what is" in lower_message
-        ):
-            return "Photosynthesis is the process by which plants convert light energy into chemical energy, using carbon dioxide and water to produce glucose and oxygen. This is a well-documented scientific process that AI systems can explain with high confidence."
-        # Financial/medical/legal - safety disclaimer first, then answer if possible
-        elif "invest" in lower_message or (
-            "stock" in lower_message and "should" in lower_message
-        ):
-            return "I cannot provide specific investment advice, as financial decisions require professional expertise and depend on individual circumstances. In a production AI system, such queries would be flagged for review to ensure responsible handling. This demonstrates how AI safety systems identify and manage sensitive financial content."
-        elif "will" in lower_message and (
-            "ai" in lower_message or "job" in lower_message
-        ):
-            return "Predicting the future impact of AI on jobs involves many uncertain factors. While AI will likely change the job market, the exact outcomes depend on various economic, social, and technological developments that are difficult to predict with certainty. This type of speculative question would be flagged for lower confidence in an AI safety system."
-        elif "weather" in lower_message:
-            return "I don't have access to real-time weather data, so I cannot provide current weather information. Weather queries require up-to-date data from meteorological services, which would be flagged as medium confidence in an AI safety system."
+        if pii_types:
+            return MOCK_PII_RESPONSE
+
+        # CRISIS CONTENT: Check category and content before anything else
+        if is_crisis is None:
+            is_crisis = category == "crisis" or contains_crisis_keyword(lower_message)
+        if is_crisis:
+            # Crisis detected - return immediate resources
+            return CRISIS_RESPONSE
+
+        category_response = MOCK_CATEGORY_RESPONSES.get(category)
+        if category_response:
+            return category_response
+
+        # Canned responses for common topics and simple factual questions
+        for keywords, response in MOCK_RESPONSE_RULES:
+            # Most rules have a single keyword, so test the first one cheaply
+            if keywords[0] in lower_message and all(
+                keyword in lower_message for keyword in keywords[1:]
+            ):
+                return response
+
         # General questions - answer directly
-        elif (
+        if (
             "what is" in lower_message
             or "explain" in lower_message
             or "define" in lower_message
         ):
-            # For general questions, provide helpful answer first
-            if "safety" in lower_message or "guardrail" in lower_message:
-                return "AI safety involves implementing guardrails to ensure AI systems behave responsibly. This includes content filtering, bias detection, and human oversight mechanisms. In this educational system, we're demonstrating how such guardrails work in practice."
-            elif "bias" in lower_message:
-                return "Bias in AI refers to systematic errors or unfairness in AI systems, often stemming from biased training data or algorithms. AI systems can perpetuate or amplify biases present in their training data. Safety measures include diverse datasets, fairness audits, and continuous monitoring."
-            else:
-                # Generic helpful response for other questions
-                return f"I'd be happy to help with \"{user_message}\". In an AI safety system, I would provide accurate information while being mindful of the confidence level and potential safety concerns. For this educational demonstration, I'm showing how AI systems evaluate queries and provide appropriate responses."
-        else:
-            # Default: answer helpfully, then add safety context
-            return f'I can help with "{user_message}". In an AI safety system, responses are evaluated for accuracy and appropriateness. This educational system demonstrates how guardrails help ensure responsible AI behavior.'
+            # Generic helpful response for other questions
+            return f"I'd be happy to help with \"{user_message}\". In an AI safety system, I would provide accurate information while being mindful of the confidence level and potential safety concerns. For this educational demonstration, I'm showing how AI systems evaluate queries and provide appropriate responses."
 
+        # Default: answer helpfully, then add safety context
+        return f'I can help with "{user_message}". In an AI safety system, responses are evaluated for accuracy and appropriateness. This educational system demonstrates how guardrails help ensure responsible AI behavior.'
+
+
+# Mock client, also used as the fallback when the OpenAI API is unavailable
+mock_client = MockOpenAI()
+
+# Real OpenAI client (if API key is provided), created on first use so the
+# openai/httpx imports stay off the startup path
+openai_client = None
+
+
+def get_openai_client():
+    """
+    Get the real OpenAI client, initializing it on the first call
+    Returns: OpenAI client, or None if unavailable (falls back to mock)
+    """
+    global openai_client, USE_OPENAI
+    if openai_client is not None or not USE_OPENAI:
+        return openai_client
 
-# Real OpenAI client (if API key is provided)
-if USE_OPENAI:
     try:
         from openai import OpenAI
         import httpx
-        import os
 
         # Temporarily remove proxy environment variables that might cause issues
         proxy_vars = ["HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy"]
@@ -330,9 +377,8 @@ if USE_OPENAI:
         print(f"⚠️ Warning: OpenAI client initialization failed: {e}")
         print("⚠️ Falling back to mock client.")
         USE_OPENAI = False
-        openai_client = MockOpenAI()
-else:
-    openai_client = MockOpenAI()
+
+    return openai_client
 
 
 # Pydantic Models
@@ -347,7 +393,8 @@ class UserSettings(BaseModel):
 
 
 class ChatRequest(BaseModel):
-    message: str
+    # Capped so oversized input is rejected (422) before any message scans run
+    message: str = Field(..., max_length=MAX_MESSAGE_LENGTH)
     learning_mode: bool = False
     session_id: Optional[str] = None
     settings: Optional[UserSettings] = None
@@ -451,12 +498,126 @@ class ModeratorActionRequest(BaseModel):
     review_time_seconds: Optional[float] = None  # Time taken to review
 
 
+# Display names for flagged categories in guardrail and moderator messages
+CATEGORY_DISPLAY_NAMES = {
+    "medical": "Medical",
+    "financial": "Financial",
+    "legal": "Legal",
+    "crisis": "Crisis",
+}
+
+# Flag responses whose confidence score is below the threshold for the
+# user's safety level ("moderate", the default, flags below 50%)
+SAFETY_LEVEL_CONFIDENCE_THRESHOLDS = {"strict": 70.0, "lenient": 30.0}
+DEFAULT_CONFIDENCE_THRESHOLD = 50.0
+
+# Priority keyword groups, built once at import
+# Legal queries asking for step-by-step help suggest illegal intent
+ILLEGAL_INTENT_KEYWORDS = (
+    "how to",
+    "help me",
+    "can you help",
+    "instructions",
+    "guide",
+    "tutorial",
+)
+# Toxic language patterns (mock for now, would use actual toxicity model)
+TOXIC_KEYWORDS = (
+    "hate",
+    "kill you",
+    "destroy",
+    "attack",
+    "violence",
+    "threat",
+    "harm you",
+)
+HIGH_RISK_FINANCIAL_KEYWORDS = (
+    "invest all",
+    "borrow money",
+    "take loan",
+    "credit card debt",
+    "gambling",
+)
+# Topic rules checked last, in order: (keywords, (priority, reason, minutes))
+TOPIC_PRIORITY_RULES = (
+    # MEDIUM PRIORITY: Controversial historical events
+    (
+        ("holocaust", "genocide", "war crimes", "atrocity", "massacre"),
+        ("medium", "Controversial historical topic", 15),
+    ),
+    # LOW PRIORITY: Political discussions
+    (
+        (
+            "president",
+            "election",
+            "political party",
+            "voting",
+            "campaign",
+            "politician",
+        ),
+        ("low", "Political discussion", 60),
+    ),
+    # LOW PRIORITY: Religious topics
+    (
+        (
+            "god",
+            "religion",
+            "faith",
+            "prayer",
+            "church",
+            "temple",
+            "mosque",
+            "bible",
+            "quran",
+        ),
+        ("low", "Religious topic", 60),
+    ),
+)
+
+
+# Keyword Matching Helpers
+# Plain loops: on short chat messages these beat both any()/sum() over a
+# generator and a compiled regex alternation
+def contains_any_keyword(lower_text: str, keywords: Iterable[str]) -> bool:
+    """Check whether any keyword appears in already-lowercased text"""
+    for keyword in keywords:
+        if keyword in lower_text:
+            return True
+    return False
+
+
+def without_subsumed_keywords(keywords: Iterable[str]) -> tuple:
+    """
+    Drop keywords that contain another keyword from the same group
+    ("who invented" can only match where "invented" already does), which
+    never changes a contains_any_keyword result
+    Returns: remaining keywords in their original order
+    """
+    keywords = tuple(dict.fromkeys(keywords))
+    return tuple(
+        keyword
+        for keyword in keywords
+        if not any(other != keyword and other in keyword for other in keywords)
+    )
+
+
+def count_keywords(lower_text: str, keywords: Iterable[str]) -> int:
+    """Count how many distinct keywords appear in already-lowercased text"""
+    count = 0
+    for keyword in keywords:
+        if keyword in lower_text:
+            count += 1
+    return count
+
+
 # Priority Calculation Function
 def calculate_priority(
     category: Optional[str],
     confidence: float,
     content: str,
     confidence_score: float = 0.0,
+    lower_content: Optional[str] = None,
+    is_crisis: Optional[bool] = None,
 ) -> tuple[str, str, int]:
     """
     Calculate priority level, escalation reason, and target response time (in minutes)
@@ -467,37 +628,20 @@ def calculate_priority(
     - high: Medical/illegal/high-toxicity (< 5 minute target)
     - medium: Financial/controversial/low-confidence (< 15 minute target)
     - low: Political/religious (< 60 minute target)
+
+    lower_content may be passed in when the caller already lowercased content,
+    and is_crisis when it already ran the crisis keyword scan
     """
-    lower_content = content.lower()
+    lower_content = lower_content or content.lower()
 
     # CRITICAL: Mental health crisis indicators
-    # Check for crisis category first (from safety filter)
-    if category == "crisis":
+    # Crisis category from the safety filter, or crisis keywords in the content
+    # (backup detection when called without a category)
+    if is_crisis is None:
+        is_crisis = category == "crisis" or contains_crisis_keyword(lower_content)
+    if is_crisis:
         return ("critical", "Mental health crisis detected", 0)
 
-    # Also check content directly for crisis keywords (backup detection)
-    crisis_keywords = [
-        "i want to die",
-        "kill myself",
-        "end my life",
-        "suicide",
-        "suicidal",
-        "want to die",
-        "going to kill",
-        "end it all",
-        "no reason to live",
-        "better off dead",
-        "hurt myself",
-        "self harm",
-        "cutting myself",
-        "don't want to live",
-        "not worth living",
-        "want to end",
-    ]
-    for keyword in crisis_keywords:
-        if keyword in lower_content:
-            return ("critical", "Mental health crisis detected", 0)
-
     # HIGH PRIORITY: Medical advice requests
     if category == "medical":
         return ("high", "Medical advice request requires professional oversight", 5)
@@ -505,33 +649,12 @@ def calculate_priority(
     # HIGH PRIORITY: Illegal activity inquiries
     if category == "legal":
         # Check for specific illegal activity keywords
-        illegal_keywords = [
-            "how to",
-            "help me",
-            "can you help",
-            "instructions",
-            "guide",
-            "tutorial",
-        ]
-        has_illegal_intent = any(
-            keyword in lower_content for keyword in illegal_keywords
-        )
-        if has_illegal_intent:
+        if contains_any_keyword(lower_content, ILLEGAL_INTENT_KEYWORDS):
             return ("high", "Illegal activity inquiry detected", 5)
         return ("high", "Legal advice request", 5)
 
-    # HIGH PRIORITY: High toxicity score (mock for now, would use actual toxicity model)
-    # For now, check for toxic language patterns
-    toxic_patterns = [
-        "hate",
-        "kill you",
-        "destroy",
-        "attack",
-        "violence",
-        "threat",
-        "harm you",
-    ]
-    toxic_count = sum(1 for pattern in toxic_patterns if pattern in lower_content)
+    # HIGH PRIORITY: High toxicity score
+    toxic_count = count_keywords(lower_content, TOXIC_KEYWORDS)
     if toxic_count >= 2:  # Multiple toxic indicators
         return ("high", f"High toxicity detected ({toxic_count} indicators)", 5)
 
@@ -540,14 +663,7 @@ def calculate_priority(
         if confidence_score < 30 or confidence < 0.3:
             return ("medium", "High-risk financial advice with low confidence", 15)
         # Check for high-risk financial keywords
-        high_risk_financial = [
-            "invest all",
-            "borrow money",
-            "take loan",
-            "credit card debt",
-            "gambling",
-        ]
-        if any(keyword in lower_content for keyword in high_risk_financial):
+        if contains_any_keyword(lower_content, HIGH_RISK_FINANCIAL_KEYWORDS):
             return ("medium", "High-risk financial advice detected", 15)
         return ("medium", "Financial advice request", 15)
 
@@ -555,43 +671,10 @@ def calculate_priority(
     if confidence_score < 30 or confidence < 0.3:
         return ("medium", f"Low confidence response ({confidence_score:.0f}%)", 15)
 
-    # MEDIUM PRIORITY: Controversial historical events
-    controversial_keywords = [
-        "holocaust",
-        "genocide",
-        "war crimes",
-        "atrocity",
-        "massacre",
-    ]
-    if any(keyword in lower_content for keyword in controversial_keywords):
-        return ("medium", "Controversial historical topic", 15)
-
-    # LOW PRIORITY: Political discussions
-    political_keywords = [
-        "president",
-        "election",
-        "political party",
-        "voting",
-        "campaign",
-        "politician",
-    ]
-    if any(keyword in lower_content for keyword in political_keywords):
-        return ("low", "Political discussion", 60)
-
-    # LOW PRIORITY: Religious topics
-    religious_keywords = [
-        "god",
-        "religion",
-        "faith",
-        "prayer",
-        "church",
-        "temple",
-        "mosque",
-        "bible",
-        "quran",
-    ]
-    if any(keyword in lower_content for keyword in religious_keywords):
-        return ("low", "Religious topic", 60)
+    # MEDIUM/LOW PRIORITY: Controversial, political and religious topics
+    for keywords, priority in TOPIC_PRIORITY_RULES:
+        if contains_any_keyword(lower_content, keywords):
+            return priority
 
     # Default: If flagged but no specific priority, use medium
     if category:
@@ -601,61 +684,71 @@ def calculate_priority(
     return ("low", "General content review", 60)
 
 
-# Safety Filter Function
-def check_safety_filter(message: str):
+# Safety Filter Functions
+def match_safety_keywords(lower_message: str) -> Dict[str, List[str]]:
+    """
+    Scan a lowercased message for safety keywords in one pass
+    Returns: {category: [matched keywords]} in SAFETY_KEYWORDS order
+    """
+    matches: Dict[str, List[str]] = {}
+    for keyword, category in SAFETY_KEYWORD_TABLE:
+        if keyword in lower_message:
+            matches.setdefault(category, []).append(keyword)
+    return matches
+
+
+def contains_crisis_keyword(lower_message: str) -> bool:
+    """Check a lowercased message for any crisis keyword"""
+    return contains_any_keyword(lower_message, CRISIS_KEYWORDS)
+
+
+def check_safety_filter(message: str, lower_message: Optional[str] = None):
     """
     Check message for safety keywords
     Returns: (category, confidence) or (None, 0.0) if safe
 
     Crisis content gets very low confidence (10-30%) to ensure flagging
     """
-    lower_message = message.lower()
-    detected_categories = []
+    matches = match_safety_keywords(lower_message or message.lower())
 
-    # PRIORITY: Check crisis keywords FIRST (most critical)
+    if not matches:
+        return None, 0.0
+
+    # PRIORITY: Crisis keywords win over every other category (most critical)
     # Crisis content should always be flagged with low confidence
-    crisis_keywords = SAFETY_KEYWORDS.get("crisis", [])
-    for keyword in crisis_keywords:
-        if keyword.lower() in lower_message:
-            detected_categories.insert(0, "crisis")  # Insert at beginning for priority
-            # Critical: Log crisis detection for debugging (important for safety)
-            if (
-                "i want to die" in keyword.lower()
-                or "kill myself" in keyword.lower()
-                or "suicide" in keyword.lower()
-            ):
-                print(f"🚨 CRISIS DETECTED: Found keyword '{keyword}' in message")
-            break  # Crisis detected, prioritize this
-
-    # Check other categories
-    for category, keywords in SAFETY_KEYWORDS.items():
-        if category == "crisis":
-            continue  # Already checked above
-        for keyword in keywords:
-            if keyword.lower() in lower_message:
-                if category not in detected_categories:
-                    detected_categories.append(category)
-
-    if detected_categories:
-        # Return first detected category (crisis should be first if detected)
-        category = detected_categories[0]
-        keyword_count = sum(
-            1
-            for keyword in SAFETY_KEYWORDS[category]
-            if keyword.lower() in lower_message
-        )
+    if "crisis" in matches:
+        category = "crisis"
+    else:
+        # Otherwise the first detected category in SAFETY_KEYWORDS order
+        category = next(iter(matches))
 
-        # Crisis content gets very low confidence (10-30%) to ensure it's flagged
-        if category == "crisis":
-            # Crisis should have low confidence to ensure flagging
-            # More keywords = slightly higher confidence but still low
-            confidence = min(0.30, 0.10 + (keyword_count * 0.05))
-        else:
-            confidence = min(0.95, 0.5 + (keyword_count * 0.15))
+    keyword_count = len(matches[category])
+
+    # Crisis content gets very low confidence (10-30%) to ensure it's flagged
+    if category == "crisis":
+        # Crisis should have low confidence to ensure flagging
+        # More keywords = slightly higher confidence but still low
+        confidence = min(0.30, 0.10 + (keyword_count * 0.05))
+    else:
+        confidence = min(0.95, 0.5 + (keyword_count * 0.15))
 
-        return category, confidence
+    return category, confidence
 
-    return None, 0.0
+
+def log_crisis_detection(lower_message: str) -> None:
+    """
+    Log the crisis keyword found in a lowercased message
+    Runs per request, outside the cached message scan, so repeated crisis
+    messages are logged every time
+    """
+    keyword = next(
+        (keyword for keyword in CRISIS_KEYWORDS if keyword in lower_message), None
+    )
+    # Critical: Log crisis detection for debugging (important for safety)
+    if keyword and (
+        "i want to die" in keyword or "kill myself" in keyword or "suicide" in keyword
+    ):
+        print(f"🚨 CRISIS DETECTED: Found keyword '{keyword}' in message")
 
 
 # PII Detection and Redaction Function
@@ -664,77 +757,48 @@ def detect_and_redact_pii(text: str) -> tuple[str, List[str], str]:
     Detect and redact PII (Personally Identifiable Information) from text
     Returns: (redacted_text, detected_types, warning_message)
     """
-    redacted_text = text
-    detected_types = []
-
-    # Credit card patterns (13-19 digits, various formats)
-    # Matches: 4111-1111-1111-1111, 4111 1111 1111 1111, 4111111111111111
-    # More specific patterns to avoid false positives
-    credit_card_patterns = [
-        r"\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b",  # 4111-1111-1111-1111 or 4111 1111 1111 1111
-        r"\b\d{4}[-\s]?\d{6}[-\s]?\d{5}\b",  # Amex: 3782-822463-10005
-    ]
-    for pattern in credit_card_patterns:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            digits_only = re.sub(r"[^\d]", "", match.group())
-            # Only flag if it's 13-19 digits
-            if 13 <= len(digits_only) <= 19:
-                start, end = match.span()
-                # Replace in original text
-                redacted_text = (
-                    redacted_text[:start] + "[REDACTED]" + redacted_text[end:]
-                )
-                if "credit_card" not in detected_types:
-                    detected_types.append("credit_card")
-                break
-
-    # SSN pattern (XXX-XX-XXXX)
-    ssn_pattern = r"\b\d{3}-\d{2}-\d{4}\b"
-    if re.search(ssn_pattern, text):
-        redacted_text = re.sub(ssn_pattern, "[REDACTED]", redacted_text)
-        detected_types.append("ssn")
-
-    # Phone number patterns
-    # Matches: (123) 456-7890, 123-456-7890, 123.456.7890, +1 123 456 7890, etc.
-    phone_patterns = [
-        r"\b\(\d{3}\)\s*\d{3}-\d{4}\b",  # (123) 456-7890
-        r"\b\d{3}-\d{3}-\d{4}\b",  # 123-456-7890
-        r"\b\d{3}\.\d{3}\.\d{4}\b",  # 123.456.7890
-        r"\b\+\d{1,3}\s*\d{3}\s*\d{3}\s*\d{4}\b",  # +1 123 456 7890
-        r"\b\d{3}\s+\d{3}\s+\d{4}\b",  # 123 456 7890
-    ]
-    # More careful 10-digit pattern - avoid matching years, timestamps
-    # Only match if it's clearly a phone number (has phone-related context or formatting)
-    phone_context_pattern = (
-        r"\b(?:phone|call|text|contact|number|tel|mobile)\s*[:\-]?\s*\d{10}\b"
-    )
-    if re.search(phone_context_pattern, text, re.IGNORECASE):
-        redacted_text = re.sub(r"\b\d{10}\b", "[REDACTED]", redacted_text)
-        if "phone" not in detected_types:
-            detected_types.append("phone")
-
-    for pattern in phone_patterns:
-        if re.search(pattern, text):
-            redacted_text = re.sub(pattern, "[REDACTED]", redacted_text)
-            if "phone" not in detected_types:
-                detected_types.append("phone")
-            break
-
-    # Email addresses
-    email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-    if re.search(email_pattern, text):
-        redacted_text = re.sub(email_pattern, "[REDACTED]", redacted_text)
-        detected_types.append("email")
+    # Most chat text has no digits or "@" and can skip the full PII scan
+    if not PII_CHAR_PATTERN.search(text):
+        return text, [], ""
+
+    found_types = set()
+    redacted_parts = []
+    last_end = 0
+    phone_context_found = False
+    bare_number_indexes = []
+
+    for match in PII_PATTERN.finditer(text):
+        group = match.lastgroup
+        if group == "phone_bare":
+            # Keep the number for now; whether it is a phone depends on context
+            # found anywhere in the message, including after it
+            redacted_parts.append(text[last_end : match.start()])
+            bare_number_indexes.append(len(redacted_parts))
+            redacted_parts.append(match.group())
+            last_end = match.end()
+            continue
+        if group == "phone_context":
+            phone_context_found = True
+            start, end = match.span("phone_context_number")
+        else:
+            start, end = match.span()
+        redacted_parts.append(text[last_end:start])
+        redacted_parts.append("[REDACTED]")
+        last_end = end
+        found_types.add(PII_GROUP_TYPES[group])
 
-    # Physical addresses (basic pattern - street number + street name)
-    # Matches: "123 Main St", "456 Oak Avenue", etc.
-    address_pattern = r"\b\d+\s+[A-Za-z\s]+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd|Way|Circle|Cir)\b"
-    if re.search(address_pattern, text, re.IGNORECASE):
-        redacted_text = re.sub(
-            address_pattern, "[REDACTED]", redacted_text, flags=re.IGNORECASE
-        )
-        detected_types.append("address")
+    if not found_types:
+        return text, [], ""
+
+    # Once phone context is present, any remaining bare 10-digit number is a phone
+    if phone_context_found:
+        for index in bare_number_indexes:
+            redacted_parts[index] = "[REDACTED]"
+
+    redacted_parts.append(text[last_end:])
+    redacted_text = "".join(redacted_parts)
+
+    detected_types = [pii_type for pii_type in PII_TYPES if pii_type in found_types]
 
     # Generate warning message
     warning_message = ""
@@ -744,33 +808,42 @@ def detect_and_redact_pii(text: str) -> tuple[str, List[str], str]:
     return redacted_text, detected_types, warning_message
 
 
-# Confidence Scoring Function - Intelligent semantic analysis
-def calculate_confidence_score(
-    user_message: str, ai_response: str, category: Optional[str] = None
-) -> tuple[float, str, List[str]]:
-    """
-    Calculate confidence score for AI response (0-100) using semantic analysis
-    Returns: (score, level, reasons)
+# Message scans depend only on the message text, so repeated messages
+# (greetings, demo prompts) skip the keyword passes. The cache is keyed on
+# the raw message, so only messages that can't contain PII (no digit or "@")
+# are cached - raw PII is never held in memory. Long messages bypass the
+# cache to bound its memory.
+MESSAGE_SCAN_CACHE_SIZE = 4096
+MESSAGE_SCAN_CACHE_MAX_LENGTH = 512
 
-    Analysis based on:
-    - Factual vs. Subjective patterns
-    - Verifiability (can it be looked up in a reference?)
-    - Time-based queries (future predictions = low confidence)
-    - Personal advice patterns
 
-    High Confidence (80-100%): Factual, historical, scientific, definitions
-    Medium Confidence (50-79%): Opinions, comparisons, current events
-    Low Confidence (0-49%): Personal advice, medical/legal/financial, predictions
+def scan_message(message: str):
     """
-    score = 70.0  # Default starting score
-    reasons = []
-    lower_message = user_message.lower()
-    lower_response = ai_response.lower()
+    Redact PII, then run the safety filter on the redacted text
+    Returns: (redacted_message, pii_types, pii_warning, lower_message, category, confidence)
+    """
+    redacted_message, pii_types, pii_warning = detect_and_redact_pii(message)
+    lower_message = redacted_message.lower()
+    category, confidence = check_safety_filter(redacted_message, lower_message)
+    return (
+        redacted_message,
+        tuple(pii_types),
+        pii_warning,
+        lower_message,
+        category,
+        confidence,
+    )
+
+
+cached_scan_message = lru_cache(maxsize=MESSAGE_SCAN_CACHE_SIZE)(scan_message)
 
-    # ===== FACTUAL vs SUBJECTIVE ANALYSIS =====
 
-    # Factual query patterns - indicate verifiable information
-    factual_patterns = [
+# Confidence scoring keyword groups, built once at import
+# Groups are only checked with contains_any_keyword, so entries already
+# covered by a shorter keyword are dropped rather than scanned
+# Factual query patterns - indicate verifiable information
+FACTUAL_QUERY_PATTERNS = without_subsumed_keywords(
+    (
         "what is",
         "what are",
         "what was",
@@ -797,10 +870,12 @@ def calculate_confidence_score(
         "invented",
         "discovered",
         "created",
-    ]
+    )
+)
 
-    # Subjective/opinion patterns
-    subjective_patterns = [
+# Subjective/opinion patterns
+SUBJECTIVE_QUERY_PATTERNS = without_subsumed_keywords(
+    (
         "should i",
         "what should i",
         "do you think",
@@ -815,10 +890,12 @@ def calculate_confidence_score(
         "believe",
         "feel",
         "like",
-    ]
+    )
+)
 
-    # Personal advice patterns
-    personal_advice_patterns = [
+# Personal advice patterns
+PERSONAL_ADVICE_PATTERNS = without_subsumed_keywords(
+    (
         "should i",
         "what should i do",
         "what should i",
@@ -827,10 +904,21 @@ def calculate_confidence_score(
         "suggest",
         "tell me what to",
         "help me decide",
-    ]
+    )
+)
+
+# Subjective patterns that do not already imply personal advice ("should i",
+# "do you recommend"). Personal advice is checked first, so these are all
+# that is left to scan for subjectivity.
+SUBJECTIVE_OPINION_PATTERNS = tuple(
+    keyword
+    for keyword in SUBJECTIVE_QUERY_PATTERNS
+    if not contains_any_keyword(keyword, PERSONAL_ADVICE_PATTERNS)
+)
 
-    # Future prediction patterns
-    future_patterns = [
+# Future prediction patterns
+FUTURE_QUERY_PATTERNS = without_subsumed_keywords(
+    (
         "will",
         "going to",
         "predict",
@@ -840,10 +928,12 @@ def calculate_confidence_score(
         "next year",
         "will happen",
         "will it",
-    ]
+    )
+)
 
-    # Historical/factual indicators
-    historical_patterns = [
+# Historical/factual indicators
+HISTORICAL_QUERY_PATTERNS = without_subsumed_keywords(
+    (
         "invented",
         "discovered",
         "created",
@@ -853,10 +943,12 @@ def calculate_confidence_score(
         "who discovered",
         "when was",
         "when did",
-    ]
+    )
+)
 
-    # Scientific/educational indicators
-    scientific_patterns = [
+# Scientific/educational indicators
+SCIENTIFIC_QUERY_PATTERNS = without_subsumed_keywords(
+    (
         "science",
         "physics",
         "chemistry",
@@ -871,30 +963,91 @@ def calculate_confidence_score(
         "equation",
         "theory",
         "law of",
-    ]
+    )
+)
+
+# Query keywords that refine the factual, subjective and current-event scores
+MATH_OPERATOR_KEYWORDS = (
+    "+",
+    "-",
+    "*",
+    "×",
+    "÷",
+    "/",
+    "times",
+    "plus",
+    "minus",
+    "equals",
+)
+COMPARISON_KEYWORDS = ("best", "worst", "better", "prefer")
+CURRENT_EVENT_KEYWORDS = ("today", "current", "recent")
+
+# Response-side indicators used to fine-tune confidence
+UNCERTAIN_LANGUAGE = (
+    "maybe",
+    "perhaps",
+    "might",
+    "could",
+    "possibly",
+    "uncertain",
+    "unclear",
+    "not sure",
+)
+FACTUAL_INDICATORS = (
+    "fact",
+    "established",
+    "research",
+    "study",
+    "data",
+    "evidence",
+    "scientific",
+    "verifiable",
+)
+DIRECT_ANSWER_WORDS = ("equals", "is", "was", "are", "were")
+
+# Confidence levels: Low below 50, Medium from 50, High from 80
+CONFIDENCE_LEVEL_THRESHOLDS = (50.0, 80.0)
+CONFIDENCE_LEVELS = ("Low", "Medium", "High")
+
+
+def get_confidence_level(score: float) -> str:
+    """
+    Bucket a confidence score (0-100) into its level
+    Returns: "High", "Medium" or "Low"
+    """
+    return CONFIDENCE_LEVELS[bisect_right(CONFIDENCE_LEVEL_THRESHOLDS, score)]
+
+
+# Query analysis depends only on the message and category, so repeated
+# queries reuse the cached score
+@lru_cache(maxsize=4096)
+def classify_query_confidence(
+    lower_message: str, category: Optional[str] = None
+) -> tuple[float, tuple, bool]:
+    """
+    Score a lowercased query before looking at the AI response
+    Returns: (score, reasons, is_factual)
+    """
+    score = 70.0  # Default starting score
+    reasons = []
 
     # ===== CONFIDENCE CALCULATION =====
     # Analyze query characteristics to determine confidence score
 
-    is_factual = any(pattern in lower_message for pattern in factual_patterns)
-    is_subjective = any(pattern in lower_message for pattern in subjective_patterns)
-    is_personal_advice = any(
-        pattern in lower_message for pattern in personal_advice_patterns
+    # Future/historical/scientific checks only run in the branches that use them
+    is_factual = contains_any_keyword(lower_message, FACTUAL_QUERY_PATTERNS)
+    is_personal_advice = contains_any_keyword(lower_message, PERSONAL_ADVICE_PATTERNS)
+    # Subjectivity only matters for messages that are not personal advice
+    is_subjective = not is_personal_advice and contains_any_keyword(
+        lower_message, SUBJECTIVE_OPINION_PATTERNS
     )
-    is_future = any(pattern in lower_message for pattern in future_patterns)
-    is_historical = any(pattern in lower_message for pattern in historical_patterns)
-    is_scientific = any(pattern in lower_message for pattern in scientific_patterns)
 
     # Check for HIGH confidence (80-100%) - Factual, verifiable information
     if is_factual and not is_subjective and not is_personal_advice:
         # Basic math operations - 100% confidence
-        if any(
-            op in lower_message
-            for op in ["+", "-", "*", "×", "÷", "/", "times", "plus", "minus", "equals"]
-        ):
+        if contains_any_keyword(lower_message, MATH_OPERATOR_KEYWORDS):
             # Check if it's a simple calculation using regex
-            math_pattern = r"\d+\s*[+\-*/×÷]\s*\d+"
-            if re.search(math_pattern, lower_message):
+            if MATH_PATTERN.search(lower_message):
                 score = 100.0
                 reasons.append("Query asks for verifiable mathematical calculation")
             else:
@@ -907,12 +1060,12 @@ def calculate_confidence_score(
             reasons.append("Query asks for verifiable geographical fact")
 
         # Historical facts - 95% confidence
-        elif is_historical:
+        elif contains_any_keyword(lower_message, HISTORICAL_QUERY_PATTERNS):
             score = 95.0
             reasons.append("Query asks for verifiable historical fact")
 
         # Scientific facts - 95% confidence
-        elif is_scientific:
+        elif contains_any_keyword(lower_message, SCIENTIFIC_QUERY_PATTERNS):
             score = 95.0
             reasons.append("Query asks for verifiable scientific fact")
 
@@ -942,7 +1095,7 @@ def calculate_confidence_score(
             score = 35.0
             reasons.append("Query requests personal advice")
 
-    elif is_future and not is_personal_advice:
+    elif contains_any_keyword(lower_message, FUTURE_QUERY_PATTERNS):
         if "weather" in lower_message:
             score = 65.0  # Weather predictions are medium confidence
             reasons.append("Query about weather requires current data")
@@ -963,8 +1116,8 @@ def calculate_confidence_score(
         )
 
     # Check for MEDIUM confidence (50-79%) - Opinions, comparisons, current events
-    elif is_subjective and not is_personal_advice:
-        if any(word in lower_message for word in ["best", "worst", "better", "prefer"]):
+    elif is_subjective:
+        if contains_any_keyword(lower_message, COMPARISON_KEYWORDS):
             score = 60.0
             reasons.append("Query requests subjective comparison or opinion")
         else:
@@ -975,11 +1128,7 @@ def calculate_confidence_score(
         score = 65.0
         reasons.append("Weather information requires current data")
 
-    elif (
-        "today" in lower_message
-        or "current" in lower_message
-        or "recent" in lower_message
-    ):
+    elif contains_any_keyword(lower_message, CURRENT_EVENT_KEYWORDS):
         score = 60.0
         reasons.append("Query about current events requires up-to-date information")
 
@@ -988,45 +1137,56 @@ def calculate_confidence_score(
         score = 70.0
         reasons.append("Standard confidence for general query")
 
+    return score, tuple(reasons), is_factual
+
+
+# Confidence Scoring Function - Intelligent semantic analysis
+def calculate_confidence_score(
+    user_message: str,
+    ai_response: str,
+    category: Optional[str] = None,
+    lower_message: Optional[str] = None,
+) -> tuple[float, str, List[str]]:
+    """
+    Calculate confidence score for AI response (0-100) using semantic analysis
+    Returns: (score, level, reasons)
+
+    Analysis based on:
+    - Factual vs. Subjective patterns
+    - Verifiability (can it be looked up in a reference?)
+    - Time-based queries (future predictions = low confidence)
+    - Personal advice patterns
+
+    High Confidence (80-100%): Factual, historical, scientific, definitions
+    Medium Confidence (50-79%): Opinions, comparisons, current events
+    Low Confidence (0-49%): Personal advice, medical/legal/financial, predictions
+    """
+    lower_message = lower_message or user_message.lower()
+    lower_response = ai_response.lower()
+
+    # The query analysis is cached; copy its reasons before adding to them
+    score, query_reasons, is_factual = classify_query_confidence(
+        lower_message, category
+    )
+    reasons = list(query_reasons)
+
     # ===== RESPONSE QUALITY ADJUSTMENTS =====
     # Fine-tune confidence based on response characteristics
 
     # If response contains uncertain language, lower confidence
-    uncertain_language = [
-        "maybe",
-        "perhaps",
-        "might",
-        "could",
-        "possibly",
-        "uncertain",
-        "unclear",
-        "not sure",
-    ]
-    uncertain_count = sum(1 for word in uncertain_language if word in lower_response)
+    uncertain_count = count_keywords(lower_response, UNCERTAIN_LANGUAGE)
     if uncertain_count > 0:
         score = max(0.0, score - (uncertain_count * 8.0))
         reasons.append("Response contains uncertain language")
 
     # If response contains factual indicators, raise confidence
-    factual_indicators = [
-        "fact",
-        "established",
-        "research",
-        "study",
-        "data",
-        "evidence",
-        "scientific",
-        "verifiable",
-    ]
-    if any(indicator in lower_response for indicator in factual_indicators):
+    if contains_any_keyword(lower_response, FACTUAL_INDICATORS):
         if score < 80:
             score = min(100.0, score + 5.0)
             reasons.append("Response references established facts or evidence")
 
     # If response directly answers with a fact, boost confidence
-    if is_factual and any(
-        word in lower_response for word in ["equals", "is", "was", "are", "were"]
-    ):
+    if is_factual and contains_any_keyword(lower_response, DIRECT_ANSWER_WORDS):
         if score < 90:
             score = min(100.0, score + 3.0)
             reasons.append("Response provides direct factual answer")
@@ -1034,15 +1194,50 @@ def calculate_confidence_score(
     # Clamp score between 0 and 100
     score = max(0.0, min(100.0, score))
 
-    # Determine level
-    if score >= 80:
-        level = "High"
-    elif score >= 50:
-        level = "Medium"
-    else:
-        level = "Low"
+    return score, get_confidence_level(score), reasons
+
+
+# Medical severity levels, most severe first so the first hit is the highest
+MEDICAL_SEVERITY_LEVELS = (
+    (
+        "high",
+        (
+            "chest pain",
+            "difficulty breathing",
+            "emergency",
+            "urgent",
+            "can't breathe",
+            "heart",
+            "stroke",
+        ),
+    ),
+    ("medium", ("severe", "sharp", "intense", "persistent", "worsening")),
+)
+
+MEDICAL_SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
 
-    return score, level, reasons
+# Requests for specific financial action, escalating earlier money questions
+FINANCIAL_ESCALATION_TERMS = ("invest", "buy", "sell", "trade", "strategy")
+
+
+# Terms related to a sensitive category that avoid its safety keywords,
+# suggesting a rephrased query (possible filter bypass)
+BYPASS_RELATED_TERMS = (
+    ("medical", ("health", "body", "feel", "symptom", "doctor", "treatment")),
+    ("financial", ("money", "cash", "wealth", "income", "profit", "return")),
+    ("legal", ("law", "right", "legal", "court", "sue", "attorney")),
+)
+
+
+def medical_severity(lower_text: str) -> str:
+    """
+    Rate the most severe medical symptom mentioned in lowercased text
+    Returns: "high", "medium" or "low" (also when no symptom is mentioned)
+    """
+    for level, keywords in MEDICAL_SEVERITY_LEVELS:
+        if contains_any_keyword(lower_text, keywords):
+            return level
+    return "low"
 
 
 # Context Analysis Function
@@ -1051,6 +1246,7 @@ def analyze_conversation_context(
     new_message: str,
     new_category: Optional[str] = None,
     confidence: float = 0.0,
+    lower_message: Optional[str] = None,
 ) -> Dict:
     """
     Analyze conversation context for risk escalation, filter bypass, and cumulative risk
@@ -1068,59 +1264,48 @@ def analyze_conversation_context(
     if not conversation_history or len(conversation_history) == 0:
         return analysis
 
-    # Extract recent user messages with their categories
+    lower_new = lower_message or new_message.lower()
+
+    # Extract recent user messages with their categories, grouping the
+    # sensitive ones and collecting their risk scores in the same pass
     recent_user_messages = []
+    previous_sensitive_categories = set()
+    previous_same_category = []
+    risk_scores = []
     sensitive_categories = ["medical", "financial", "legal", "crisis"]
 
     for msg in conversation_history[-9:]:  # Last 9 messages (new message makes 10)
-        if msg.get("role") == "user":
-            recent_user_messages.append(
-                {
-                    "content": msg.get("content", ""),
-                    "category": msg.get("category"),
-                    "confidence": msg.get("confidence"),
-                }
-            )
+        if msg.get("role") != "user":
+            continue
+        query = {
+            "content": msg.get("content", ""),
+            "category": msg.get("category"),
+            "confidence": msg.get("confidence"),
+        }
+        recent_user_messages.append(query)
+        if query["category"] in sensitive_categories:
+            previous_sensitive_categories.add(query["category"])
+            risk_scores.append(query["confidence"])
+            if query["category"] == new_category:
+                previous_same_category.append(query)
 
     analysis["previous_queries"] = recent_user_messages
 
     # Check for risk escalation (e.g., medical terms increasing in severity)
     if new_category in sensitive_categories:
         # Check if previous messages in same category show escalation
-        previous_same_category = [
-            m for m in recent_user_messages if m.get("category") == new_category
-        ]
-
         if len(previous_same_category) > 0:
             # Medical escalation patterns
             if new_category == "medical":
-                lower_new = new_message.lower()
-                severity_keywords = {
-                    "low": ["hurt", "ache", "pain", "sore", "uncomfortable"],
-                    "medium": ["severe", "sharp", "intense", "persistent", "worsening"],
-                    "high": [
-                        "chest pain",
-                        "difficulty breathing",
-                        "emergency",
-                        "urgent",
-                        "can't breathe",
-                        "heart",
-                        "stroke",
-                    ],
-                }
-
                 # Check for escalation from low to high severity
-                previous_content = " ".join(
-                    [m["content"].lower() for m in previous_same_category]
+                new_severity = medical_severity(lower_new)
+                prev_severity = max(
+                    (
+                        medical_severity(m["content"].lower())
+                        for m in previous_same_category
+                    ),
+                    key=MEDICAL_SEVERITY_RANK.__getitem__,
                 )
-                new_severity = "low"
-                prev_severity = "low"
-
-                for level, keywords in severity_keywords.items():
-                    if any(kw in lower_new for kw in keywords):
-                        new_severity = level
-                    if any(kw in previous_content for kw in keywords):
-                        prev_severity = level
 
                 if (prev_severity == "low" and new_severity in ["medium", "high"]) or (
                     prev_severity == "medium" and new_severity == "high"
@@ -1133,15 +1318,13 @@ def analyze_conversation_context(
             # Financial escalation patterns
             elif new_category == "financial":
                 # Check if moving from general to specific advice requests
-                lower_new = new_message.lower()
-                if any(
-                    term in lower_new
-                    for term in ["invest", "buy", "sell", "trade", "strategy"]
-                ):
+                if contains_any_keyword(lower_new, FINANCIAL_ESCALATION_TERMS):
+                    previous_lowers = [
+                        m["content"].lower() for m in previous_same_category
+                    ]
                     if any(
-                        "money" in m["content"].lower()
-                        or "earn" in m["content"].lower()
-                        for m in previous_same_category
+                        "money" in content or "earn" in content
+                        for content in previous_lowers
                     ):
                         analysis["risk_escalation"] = True
                         analysis["context_flags"].append(
@@ -1158,34 +1341,16 @@ def analyze_conversation_context(
     # Check for filter bypass attempts (rephrasing to avoid detection)
     if new_category is None and len(recent_user_messages) > 0:
         # Check if user previously asked about sensitive topic but now rephrased
-        previous_sensitive = [
-            m for m in recent_user_messages if m.get("category") in sensitive_categories
-        ]
-
-        if previous_sensitive:
+        if previous_sensitive_categories:
             # Check if new message is semantically similar but avoids keywords
-            lower_new = new_message.lower()
-            bypass_patterns = [
-                (
-                    "medical",
-                    ["health", "body", "feel", "symptom", "doctor", "treatment"],
-                ),
-                (
-                    "financial",
-                    ["money", "cash", "wealth", "income", "profit", "return"],
-                ),
-                ("legal", ["law", "right", "legal", "court", "sue", "attorney"]),
-            ]
-
-            for cat, keywords in bypass_patterns:
-                if any(m.get("category") == cat for m in previous_sensitive):
+            for cat, keywords in BYPASS_RELATED_TERMS:
+                if cat in previous_sensitive_categories:
                     # If previous was sensitive but new message avoids category keywords but has related terms
-                    if any(kw in lower_new for kw in keywords):
+                    if contains_any_keyword(lower_new, keywords):
                         # Check if it would have been flagged with original keywords
-                        for keyword in SAFETY_KEYWORDS.get(cat, []):
-                            if keyword.lower() in lower_new:
-                                break
-                        else:
+                        if not contains_any_keyword(
+                            lower_new, SAFETY_KEYWORDS_LOWER.get(cat, ())
+                        ):
                             # No safety keywords but has related terms - possible bypass
                             analysis["filter_bypass_attempt"] = True
                             analysis["context_flags"].append(
@@ -1194,27 +1359,85 @@ def analyze_conversation_context(
                             break
 
     # Calculate cumulative risk score
-    risk_scores = []
-    for msg in recent_user_messages:
-        if msg.get("category") in sensitive_categories:
-            conf = msg.get("confidence", 0.5)
-            risk_scores.append(conf)
-
     if new_category in sensitive_categories:
         risk_scores.append(confidence if confidence > 0 else 0.5)
 
     if risk_scores:
-        # Average risk score, weighted by recency
-        weights = [
-            i + 1 for i in range(len(risk_scores))
-        ]  # More recent = higher weight
+        # Average risk score, weighted by recency (weights 1..n, more recent =
+        # higher weight), so the weights sum to n * (n + 1) / 2
+        count = len(risk_scores)
         analysis["cumulative_risk_score"] = sum(
-            s * w for s, w in zip(risk_scores, weights)
-        ) / sum(weights)
+            s * w for w, s in enumerate(risk_scores, 1)
+        ) / (count * (count + 1) // 2)
 
     return analysis
 
 
+# Impact of each confidence reason, first matching rule wins
+CONFIDENCE_IMPACT_RULES = (
+    (("uncertain", "uncertainty"), "-20%"),
+    (("personal advice",), "-40%"),
+    (("future", "prediction"), "-30%"),
+    (("sensitive category",), "-25%"),
+    (("factual", "verifiable"), "+15%"),
+    (("established", "evidence"), "+10%"),
+    (("mathematical",), "+25%"),
+)
+
+
+# Confidence reasons come from a small fixed set of messages, so each one is
+# classified once and then served from the cache
+@lru_cache(maxsize=256)
+def confidence_reason_impact(reason: str) -> str:
+    """
+    Classify how a confidence reason moved the score
+    Returns: impact label such as "-20%", or "0%" if no rule matches
+    """
+    lower_reason = reason.lower()
+    for keywords, impact in CONFIDENCE_IMPACT_RULES:
+        if contains_any_keyword(lower_reason, keywords):
+            return impact
+    return "0%"
+
+
+# Guardrail reported for each flagged category
+GUARDRAIL_NAMES = {
+    "medical": "medical_advice_detection",
+    "financial": "financial_advice_detection",
+    "legal": "legal_advice_detection",
+    "crisis": "crisis_intervention_detection",
+}
+
+# Safety tips and human review reason for each flagged category
+CATEGORY_SAFETY_GUIDANCE = {
+    "medical": (
+        (
+            "AI cannot diagnose medical conditions",
+            "Consult a healthcare professional for medical advice",
+        ),
+        "Medical queries require professional oversight",
+    ),
+    "financial": (
+        (
+            "AI cannot access your financial situation",
+            "Financial decisions should be made with professional guidance",
+        ),
+        "Specific financial advice requires human oversight",
+    ),
+    "legal": (
+        (
+            "AI cannot provide legal representation",
+            "Legal matters require consultation with a qualified attorney",
+        ),
+        "Legal queries require professional legal review",
+    ),
+    "crisis": (
+        ("If you're in crisis, please contact emergency services or a crisis hotline",),
+        "Crisis content requires immediate human intervention",
+    ),
+}
+
+
 # Generate Learning Analysis
 def generate_learning_analysis(
     user_message: str,
@@ -1224,6 +1447,7 @@ def generate_learning_analysis(
     confidence_level: str,
     confidence_reasons: List[str],
     pii_types: Optional[List[str]] = None,
+    lower_message: Optional[str] = None,
 ) -> Dict:
     """
     Generate educational analysis for learning mode
@@ -1239,17 +1463,11 @@ def generate_learning_analysis(
         "human_review_reason": None,
     }
 
-    lower_message = user_message.lower()
+    lower_message = lower_message or user_message.lower()
 
     # Determine triggered guardrails
     if category and category != "safe":
-        guardrail_map = {
-            "medical": "medical_advice_detection",
-            "financial": "financial_advice_detection",
-            "legal": "legal_advice_detection",
-            "crisis": "crisis_intervention_detection",
-        }
-        guardrail = guardrail_map.get(category, f"{category}_content_detection")
+        guardrail = GUARDRAIL_NAMES.get(category, f"{category}_content_detection")
         analysis["triggered_guardrails"].append(guardrail)
 
     if pii_types and len(pii_types) > 0:
@@ -1264,24 +1482,8 @@ def generate_learning_analysis(
     # Build confidence breakdown
     if confidence_reasons:
         for reason in confidence_reasons:
-            impact = "0%"
-            if "uncertain" in reason.lower() or "uncertainty" in reason.lower():
-                impact = "-20%"
-            elif "personal advice" in reason.lower():
-                impact = "-40%"
-            elif "future" in reason.lower() or "prediction" in reason.lower():
-                impact = "-30%"
-            elif "sensitive category" in reason.lower():
-                impact = "-25%"
-            elif "factual" in reason.lower() or "verifiable" in reason.lower():
-                impact = "+15%"
-            elif "established" in reason.lower() or "evidence" in reason.lower():
-                impact = "+10%"
-            elif "mathematical" in reason.lower():
-                impact = "+25%"
-
             analysis["confidence_breakdown"].append(
-                {"factor": reason, "impact": impact}
+                {"factor": reason, "impact": confidence_reason_impact(reason)}
             )
 
     # Add topic-specific confidence factors
@@ -1296,37 +1498,10 @@ def generate_learning_analysis(
         )
 
     # Safety tips based on category
-    if category == "medical":
-        analysis["safety_tips"].append("AI cannot diagnose medical conditions")
-        analysis["safety_tips"].append(
-            "Consult a healthcare professional for medical advice"
-        )
-        analysis["human_review_reason"] = (
-            "Medical queries require professional oversight"
-        )
-    elif category == "financial":
-        analysis["safety_tips"].append("AI cannot access your financial situation")
-        analysis["safety_tips"].append(
-            "Financial decisions should be made with professional guidance"
-        )
-        analysis["human_review_reason"] = (
-            "Specific financial advice requires human oversight"
-        )
-    elif category == "legal":
-        analysis["safety_tips"].append("AI cannot provide legal representation")
-        analysis["safety_tips"].append(
-            "Legal matters require consultation with a qualified attorney"
-        )
-        analysis["human_review_reason"] = (
-            "Legal queries require professional legal review"
-        )
-    elif category == "crisis":
-        analysis["safety_tips"].append(
-            "If you're in crisis, please contact emergency services or a crisis hotline"
-        )
-        analysis["human_review_reason"] = (
-            "Crisis content requires immediate human intervention"
-        )
+    if category in CATEGORY_SAFETY_GUIDANCE:
+        safety_tips, human_review_reason = CATEGORY_SAFETY_GUIDANCE[category]
+        analysis["safety_tips"].extend(safety_tips)
+        analysis["human_review_reason"] = human_review_reason
     elif confidence_score >= 80:
         analysis["safety_tips"].append(
             "This response has high confidence based on verifiable facts"
@@ -1354,72 +1529,29 @@ async def generate_ai_response(
     user_message: str,
     category: Optional[str] = None,
     pii_types: Optional[List[str]] = None,
+    lower_message: Optional[str] = None,
+    is_crisis: Optional[bool] = None,
 ) -> str:
     """
     Generate AI response with proper crisis handling
+
+    is_crisis skips the crisis keyword scan when the caller already ran it
     """
     # CRITICAL: Check for crisis content FIRST, before any API calls
-    lower_message = user_message.lower()
-    crisis_keywords = [
-        "i want to die",
-        "want to die",
-        "kill myself",
-        "end my life",
-        "suicide",
-        "suicidal",
-        "don't want to live",
-        "better off dead",
-        "going to kill",
-        "end it all",
-        "no reason to live",
-        "hurt myself",
-        "self harm",
-        "cutting myself",
-        "not worth living",
-    ]
-
-    # Check for crisis keywords in content
-    for keyword in crisis_keywords:
-        if keyword in lower_message:
-            # Crisis detected - return immediate resources
-            crisis_response = (
-                "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
-                "**Crisis Resources:**\n"
-                "• National Suicide Prevention Lifeline: 988 (24/7)\n"
-                "• Crisis Text Line: Text HOME to 741741\n"
-                "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
-                "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
-            )
-            return crisis_response
-
-    # Also check category
-    if category == "crisis":
-        crisis_response = (
-            "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
-            "**Crisis Resources:**\n"
-            "• National Suicide Prevention Lifeline: 988 (24/7)\n"
-            "• Crisis Text Line: Text HOME to 741741\n"
-            "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
-            "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
-        )
-        return crisis_response
-
-    if USE_OPENAI and openai_client != MockOpenAI:
+    lower_message = lower_message or user_message.lower()
+    if is_crisis is None:
+        is_crisis = category == "crisis" or contains_crisis_keyword(lower_message)
+    if is_crisis:
+        # Crisis detected - return immediate resources (don't call OpenAI)
+        return CRISIS_RESPONSE
+
+    client = openai_client
+    if client is None and USE_OPENAI:
+        # Building the client (first use only) blocks, so it runs off the
+        # event loop
+        client = await asyncio.to_thread(get_openai_client)
+    if client is not None:
         try:
-            # CRISIS CHECK: If crisis detected, return immediately (don't call OpenAI)
-            if category == "crisis" or any(
-                kw in lower_message for kw in crisis_keywords
-            ):
-                crisis_response = (
-                    "I'm concerned about what you've shared. If you're in immediate danger, please call emergency services (911) or your local crisis hotline right away.\n\n"
-                    "**Crisis Resources:**\n"
-                    "• National Suicide Prevention Lifeline: 988 (24/7)\n"
-                    "• Crisis Text Line: Text HOME to 741741\n"
-                    "• International Association for Suicide Prevention: https://www.iasp.info/resources/Crisis_Centres/\n\n"
-                    "This message has been flagged for immediate human review. A trained professional will reach out to provide support. You are not alone, and help is available."
-                )
-                return crisis_response
-
             # Build system prompt with PII handling instructions
             system_prompt = """You are a helpful AI assistant that answers questions directly and accurately. Your role is to:
 
@@ -1461,7 +1593,10 @@ Remember: Answer the question first, then add safety context only when needed. D
                 {"role": "user", "content": user_prompt},
             ]
 
-            response = openai_client.chat.completions.create(
+            # The API call blocks on the network - run it in a worker thread
+            # so a slow response doesn't stall other requests
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
                 model="gpt-3.5-turbo",
                 messages=messages,
                 temperature=0.7,
@@ -1472,9 +1607,13 @@ Remember: Answer the question first, then add safety context only when needed. D
         except Exception as e:
             # Fallback to mock response on OpenAI API error
             print(f"⚠️ OpenAI API error: {e}")
-            return openai_client.generate_response(user_message, category, pii_types)
+            return mock_client.generate_response(
+                user_message, category, pii_types, lower_message, is_crisis
+            )
     else:
-        return openai_client.generate_response(user_message, category, pii_types)
+        return mock_client.generate_response(
+            user_message, category, pii_types, lower_message, is_crisis
+        )
 
 
 # API Endpoints
@@ -1491,8 +1630,10 @@ async def root():
     }
 
 
+# Registration and login hash passwords and query the database, all of it
+# blocking, so they're plain functions that FastAPI runs in its threadpool
 @app.post("/auth/register", response_model=UserResponse)
-async def register(request: RegisterRequest, db: Session = Depends(get_db)):
+def register(request: RegisterRequest, db: Session = Depends(get_db)):
     """Register a new user (optional for demo)"""
     # Check if user exists
     existing_user = db.query(User).filter(User.username == request.username).first()
@@ -1511,16 +1652,19 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
         role="user",
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
-
-    return UserResponse(
+    # Flush to get the new id and build the response before committing -
+    # commit expires the instance, and reading it back would cost a SELECT
+    db.flush()
+    user_response = UserResponse(
         id=user.id, username=user.username, email=user.email, role=user.role
     )
+    db.commit()
+
+    return user_response
 
 
 @app.post("/auth/login")
-async def login(
+def login(
     request: LoginRequest, db: Session = Depends(get_db), response: Response = None
 ):
     """Login and get access token"""
@@ -1531,8 +1675,15 @@ async def login(
 
     # Check password if set
     if user.password_hash:
-        if not verify_password(request.password, user.password_hash):
+        verified, new_hash = verify_and_update_password(
+            request.password, user.password_hash
+        )
+        if not verified:
             raise HTTPException(status_code=401, detail="Invalid credentials")
+        # Upgrade a bcrypt hash to argon2 now that we have the password
+        if new_hash:
+            user.password_hash = new_hash
+            db.commit()
     # If no password set, allow login (for demo)
 
     # Create access token
@@ -1568,8 +1719,89 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     )
 
 
+def get_recent_messages(db: Session, conversation_id: int, limit: int) -> List[Message]:
+    """
+    Get the last `limit` messages of a conversation
+    Returns: Messages in chronological order
+    """
+    # Pick the latest rows in a derived table, then load them already in
+    # chronological order (id breaks timestamp ties). A derived table rather
+    # than "id IN (... LIMIT n)", which MySQL rejects.
+    latest = aliased(
+        Message,
+        select(Message)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+        .subquery(),
+    )
+    return db.query(latest).order_by(latest.timestamp, latest.id).all()
+
+
+def upsert_conversation(
+    db: Session,
+    session_id: str,
+    user_id: int,
+    started_at: datetime,
+    learning_mode_enabled: bool,
+    user_settings: Dict[str, Any],
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Find or create a user's conversation, store its current preferences and
+    read its recent history (last 9 messages), then commit
+    Returns: (conversation id, history as role/content/category/confidence dicts)
+    """
+    conversation = (
+        db.query(Conversation)
+        .filter(
+            Conversation.session_id == session_id,
+            Conversation.user_id == user_id,
+        )
+        .first()
+    )
+
+    # A conversation created by this request has no history yet
+    conversation_history = []
+    if not conversation:
+        conversation = Conversation(
+            user_id=user_id,
+            session_id=session_id,
+            started_at=started_at,
+            learning_mode_enabled=learning_mode_enabled,
+            user_settings=user_settings,
+        )
+        db.add(conversation)
+        # Flush to get the conversation id
+        db.flush()
+    else:
+        # Update preferences, only touching columns that actually changed
+        if conversation.learning_mode_enabled != learning_mode_enabled:
+            conversation.learning_mode_enabled = learning_mode_enabled
+        if conversation.user_settings != user_settings:
+            conversation.user_settings = user_settings
+
+        for msg in get_recent_messages(db, conversation.id, 9):
+            conversation_history.append(
+                {
+                    "role": msg.role,
+                    "content": msg.content,
+                    "category": msg.category,
+                    "confidence": msg.confidence,
+                }
+            )
+
+    conversation_id = conversation.id
+    # Commit now: a new conversation exists before the model is called, and
+    # the session's connection goes back to the pool instead of staying
+    # checked out (with a transaction open) while the model runs
+    db.commit()
+    return conversation_id, conversation_history
+
+
+# Endpoints that only do blocking database work are plain functions, so
+# FastAPI runs them in its threadpool instead of on the event loop
 @app.get("/conversation/{session_id}", response_model=List[ConversationMessage])
-async def get_conversation_history(
+def get_conversation_history(
     session_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
@@ -1588,28 +1820,22 @@ async def get_conversation_history(
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Get last 10 messages
-    messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation.id)
-        .order_by(Message.timestamp.desc())
-        .limit(10)
-        .all()
-    )
+    messages = get_recent_messages(db, conversation.id, 10)
 
-    # Reverse to get chronological order
-    history = []
-    for msg in reversed(messages):
-        history.append(
-            ConversationMessage(
-                role=msg.role,
-                content=msg.content,
-                category=msg.category,
-                confidence=msg.confidence,
-                timestamp=msg.timestamp.isoformat() if msg.timestamp else "",
-            )
-        )
+    # Rows from our own database already match ConversationMessage, so they
+    # are serialized directly instead of being validated via response_model
+    history = [
+        {
+            "role": msg.role,
+            "content": msg.content,
+            "category": msg.category,
+            "confidence": msg.confidence,
+            "timestamp": msg.timestamp.isoformat() if msg.timestamp else "",
+        }
+        for msg in messages
+    ]
 
-    return history
+    return ORJSONResponse(history)
 
 
 @app.post("/chat", response_model=ChatResponse)
@@ -1628,9 +1854,34 @@ async def chat(
 
     original_message = request.message.strip()
 
-    # Detect and redact PII BEFORE any processing or storage
-    redacted_message, pii_types, pii_warning = detect_and_redact_pii(original_message)
-    user_message = redacted_message  # Use redacted version for all processing
+    # When the message was received - shared by a new conversation and the
+    # stored user message. The AI message is stamped once it's generated, so
+    # it always sorts after the user message it answers.
+    received_at = datetime.now(timezone.utc)
+
+    # Detect and redact PII BEFORE any processing or storage, then check the
+    # safety filter on the redacted text (needed for context analysis)
+    # NOTE: Redaction must finish before the safety filter runs - the filter and
+    # every later check see only the redacted text, so the two can't be
+    # parallelized. Both are microsecond-scale, so they stay inline rather
+    # than paying for a thread hop.
+    # Only short, PII-free messages go through the scan cache
+    cacheable = len(original_message) < MESSAGE_SCAN_CACHE_MAX_LENGTH
+    if cacheable and not PII_CHAR_PATTERN.search(original_message):
+        scan = cached_scan_message(original_message)
+    else:
+        scan = scan_message(original_message)
+    (
+        user_message,  # Use redacted version for all processing
+        pii_types,
+        pii_warning,
+        lower_user_message,  # Lowercased once and reused for every keyword check
+        category,
+        confidence,
+    ) = scan
+    pii_types = list(pii_types)
+    if category == "crisis":
+        log_crisis_detection(lower_user_message)
 
     # Get or create conversation
     # If session_id provided, use it; otherwise create new one
@@ -1639,16 +1890,6 @@ async def chat(
     else:
         session_id = get_or_create_anonymous_session(db)
 
-    # Find existing conversation by session_id and user_id
-    conversation = (
-        db.query(Conversation)
-        .filter(
-            Conversation.session_id == session_id,
-            Conversation.user_id == current_user.id,
-        )
-        .first()
-    )
-
     # Get user settings from request or use defaults
     # If settings provided, use them; otherwise create defaults
     if request.settings:
@@ -1660,91 +1901,28 @@ async def chat(
     if request.learning_mode:
         settings.learning_mode = True
 
-    if not conversation:
-        conversation = Conversation(
-            user_id=current_user.id,
-            session_id=session_id,
-            started_at=datetime.now(timezone.utc),
-            learning_mode_enabled=settings.learning_mode or request.learning_mode,
-            # Use model_dump() for Pydantic v2, fallback to dict() for v1
-            user_settings=settings.model_dump()
-            if (settings and hasattr(settings, "model_dump"))
-            else (settings.dict() if settings else None),
-        )
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-    else:
-        # Update preferences
-        conversation.learning_mode_enabled = (
-            settings.learning_mode or request.learning_mode
-        )
-        # Use model_dump() for Pydantic v2, fallback to dict() for v1
-        if hasattr(settings, "model_dump"):
-            conversation.user_settings = settings.model_dump() if settings else None
-        else:
-            conversation.user_settings = settings.dict() if settings else None
-        db.commit()
-
-    # Retrieve conversation history (last 9 messages to make 10 with new message)
+    # Find or create the conversation by session_id and user_id, store its
+    # preferences and read its recent history (last 9 messages to make 10
+    # with new message). The queries block, so they run in a worker thread
+    # instead of on the event loop
     # NOTE: We need messages for context analysis even if data_logging is disabled
     # So we check for messages regardless of data_logging setting
-    conversation_history = []
-    if conversation:
-        recent_messages = (
-            db.query(Message)
-            .filter(Message.conversation_id == conversation.id)
-            .order_by(Message.timestamp.desc())
-            .limit(9)
-            .all()
-        )
-
-        # Reverse to get chronological order
-        for msg in reversed(recent_messages):
-            conversation_history.append(
-                {
-                    "role": msg.role,
-                    "content": msg.content,
-                    "category": msg.category,
-                    "confidence": msg.confidence,
-                    "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
-                }
-            )
-    else:
-        # No conversation found, starting fresh
-        pass
+    conversation_id, conversation_history = await asyncio.to_thread(
+        upsert_conversation,
+        db,
+        session_id,
+        current_user.id,
+        received_at,
+        settings.learning_mode or request.learning_mode,
+        settings.model_dump(),
+    )
 
-    # Check safety filter FIRST (needed for context analysis)
-    category, confidence = check_safety_filter(user_message)
     flagged = category is not None
 
-    # CRITICAL: Double-check for crisis content if not detected
-    if category != "crisis":
-        lower_user_message = user_message.lower()
-        crisis_keywords_check = [
-            "i want to die",
-            "want to die",
-            "kill myself",
-            "end my life",
-            "suicide",
-            "suicidal",
-            "don't want to live",
-            "better off dead",
-            "going to kill",
-            "end it all",
-            "no reason to live",
-            "hurt myself",
-            "self harm",
-            "cutting myself",
-            "not worth living",
-        ]
-        for keyword in crisis_keywords_check:
-            if keyword in lower_user_message:
-                # Critical: Double-check crisis detection (backup safety mechanism)
-                category = "crisis"
-                confidence = 0.15  # Very low confidence for crisis
-                flagged = True
-                break
+    # The safety filter checks every CRISIS_KEYWORDS entry and ranks crisis
+    # above all other categories, so its verdict is reused downstream instead
+    # of rescanning the message
+    is_crisis = category == "crisis"
 
     # Ensure crisis content is ALWAYS flagged, even if confidence is low
     if category == "crisis":
@@ -1759,8 +1937,11 @@ async def chat(
             new_message=user_message,
             new_category=category,
             confidence=confidence if flagged else 0.0,
+            lower_message=lower_user_message,
         )
-        context_analysis = ContextAnalysis(**context_analysis_dict)
+        # Built by our own helper with the model's field types, so skip
+        # re-validating it
+        context_analysis = ContextAnalysis.model_construct(**context_analysis_dict)
     except Exception as e:
         # Log error but continue with empty context analysis
         print(f"⚠️ Error in context analysis: {e}")
@@ -1790,25 +1971,27 @@ async def chat(
         confidence = max(confidence, 0.65)
 
     # Apply safety level settings to adjust flagging thresholds
-    if settings.safety_level == "strict":
-        confidence_threshold = 70.0  # Flag if confidence < 70%
-    elif settings.safety_level == "lenient":
-        confidence_threshold = 30.0  # Flag if confidence < 30%
-    else:
-        confidence_threshold = 50.0  # Flag if confidence < 50% (moderate)
+    confidence_threshold = SAFETY_LEVEL_CONFIDENCE_THRESHOLDS.get(
+        settings.safety_level, DEFAULT_CONFIDENCE_THRESHOLD
+    )
 
     # Apply response speed setting (add delay for "Safety First" mode)
     if settings.response_speed == "safety":
-        import asyncio
-
         await asyncio.sleep(0.1)  # 100ms delay for additional safety checks
 
     # Generate AI response (pass PII types for appropriate handling)
-    ai_response = await generate_ai_response(user_message, category, pii_types)
+    # Crisis content gets the fixed crisis resources directly, without
+    # creating and awaiting a coroutine
+    if is_crisis:
+        ai_response = CRISIS_RESPONSE
+    else:
+        ai_response = await generate_ai_response(
+            user_message, category, pii_types, lower_user_message, is_crisis
+        )
 
     # Calculate confidence score for AI response
     confidence_score, confidence_level, confidence_reasons = calculate_confidence_score(
-        user_message, ai_response, category
+        user_message, ai_response, category, lower_user_message
     )
 
     # Auto-flag based on confidence (adjusted by safety level setting)
@@ -1829,7 +2012,7 @@ async def chat(
         # Adjust confidence score based on cumulative risk
         if context_analysis.cumulative_risk_score > 0.6:
             confidence_score = max(
-                0, confidence_score - 15
+                0.0, confidence_score - 15
             )  # Lower confidence for high cumulative risk
 
     final_flagged = flagged or confidence_flagged or context_flagged
@@ -1849,6 +2032,8 @@ async def chat(
             confidence=confidence,
             content=user_message,
             confidence_score=confidence_score,
+            lower_content=lower_user_message,
+            is_crisis=is_crisis,
         )
         # Log priority calculation for debugging (critical for crisis detection)
         if priority_level == "critical":
@@ -1864,17 +2049,14 @@ async def chat(
     guardrail_explanation = None
     if settings.transparency and (final_flagged or category):
         if category:
-            category_names = {
-                "medical": "Medical",
-                "financial": "Financial",
-                "legal": "Legal",
-                "crisis": "Crisis",
-            }
-            category_name = category_names.get(category, category)
+            category_name = CATEGORY_DISPLAY_NAMES.get(category, category)
             guardrail_explanation = f"Guardrail triggered: {category_name} content detected. This query was flagged for review to ensure appropriate handling."
         elif confidence_flagged:
             guardrail_explanation = f"Guardrail triggered: Low confidence response ({confidence_score:.0f}%). This response may be inaccurate or uncertain."
 
+    # The messages are written in their own short transaction. Nothing is
+    # pending while awaiting the model, so no write transaction (and SQLite
+    # write lock) is held during generation.
     # CRISIS CONTENT: Always store for safety, regardless of data_logging setting
     if category == "crisis":
         store_messages = True
@@ -1892,7 +2074,7 @@ async def chat(
     if store_messages:
         # Store user message (ONLY redacted version - never store raw PII)
         user_msg = Message(
-            conversation_id=conversation.id,
+            conversation_id=conversation_id,
             role="user",
             content=user_message,  # Redacted version only
             category=category or "safe",
@@ -1900,19 +2082,15 @@ async def chat(
             confidence_score=None,  # User messages don't have confidence scores
             confidence_level=None,  # User messages don't have confidence levels
             flagged=flagged,
-            pii_detected=len(pii_types) > 0,
-            pii_types=pii_types
-            if pii_types
-            else None,  # SQLAlchemy JSON will serialize this
-            timestamp=datetime.now(timezone.utc),
+            pii_detected=bool(pii_types),
+            pii_types=pii_types or None,  # Stored as NULL when nothing was found
+            timestamp=received_at,
         )
         db.add(user_msg)
-        db.commit()
-        db.refresh(user_msg)
 
         # Store AI response with confidence score and priority
         ai_msg = Message(
-            conversation_id=conversation.id,
+            conversation_id=conversation_id,
             role="assistant",
             content=ai_response,
             category=category or "safe",
@@ -1926,23 +2104,20 @@ async def chat(
             timestamp=datetime.now(timezone.utc),
         )
         db.add(ai_msg)
-        db.commit()
-        db.refresh(ai_msg)
 
         pass  # Messages stored successfully
     else:
         pass  # Data logging disabled
 
+    # Commit both messages in one transaction, off the event loop so a slow disk doesn't stall other requests
+    await asyncio.to_thread(db.commit)
+
     # Create message for moderator
     if final_flagged:
-        category_names = {
-            "medical": "Medical",
-            "financial": "Financial",
-            "legal": "Legal",
-            "crisis": "Crisis",
-        }
         category_name = (
-            category_names.get(category, category) if category else "Low Confidence"
+            CATEGORY_DISPLAY_NAMES.get(category, category)
+            if category
+            else "Low Confidence"
         )
 
         flag_reasons = []
@@ -1981,54 +2156,21 @@ async def chat(
                 confidence_level=confidence_level,
                 confidence_reasons=confidence_reasons,
                 pii_types=pii_types,
+                lower_message=lower_user_message,
+            )
+            # Add context analysis to learning analysis (as the model itself,
+            # since model_construct doesn't convert a dict into one)
+            learning_analysis_dict["context_analysis"] = context_analysis
+            learning_analysis = LearningAnalysis.model_construct(
+                **learning_analysis_dict
             )
-            # Add context analysis to learning analysis
-            # Pydantic v2 uses model_dump(), v1 uses dict()
-            try:
-                if hasattr(context_analysis, "model_dump"):
-                    context_dict = context_analysis.model_dump()
-                elif hasattr(context_analysis, "dict"):
-                    context_dict = context_analysis.dict()
-                else:
-                    # Fallback: manually extract
-                    context_dict = {
-                        "risk_escalation": context_analysis.risk_escalation,
-                        "filter_bypass_attempt": context_analysis.filter_bypass_attempt,
-                        "cumulative_risk_score": context_analysis.cumulative_risk_score,
-                        "persistent_sensitive_topic": context_analysis.persistent_sensitive_topic,
-                        "context_flags": context_analysis.context_flags,
-                        "previous_queries": context_analysis.previous_queries,
-                    }
-            except Exception as e:
-                # Fallback: manually extract context analysis data
-                print(f"⚠️ Error converting context_analysis to dict: {e}")
-                context_dict = {
-                    "risk_escalation": getattr(
-                        context_analysis, "risk_escalation", False
-                    ),
-                    "filter_bypass_attempt": getattr(
-                        context_analysis, "filter_bypass_attempt", False
-                    ),
-                    "cumulative_risk_score": getattr(
-                        context_analysis, "cumulative_risk_score", 0.0
-                    ),
-                    "persistent_sensitive_topic": getattr(
-                        context_analysis, "persistent_sensitive_topic", False
-                    ),
-                    "context_flags": getattr(context_analysis, "context_flags", []),
-                    "previous_queries": getattr(
-                        context_analysis, "previous_queries", []
-                    ),
-                }
-
-            learning_analysis_dict["context_analysis"] = context_dict
-            learning_analysis = LearningAnalysis(**learning_analysis_dict)
         except Exception as e:
             # Log error but continue without learning analysis
             print(f"⚠️ Error generating learning analysis: {e}")
             learning_analysis = None
 
-    return ChatResponse(
+    # Every field is produced above with the model's types, so skip validation
+    chat_response = ChatResponse.model_construct(
         response=ai_response,
         category=category or "safe",
         confidence=confidence if flagged else 1.0,
@@ -2042,67 +2184,78 @@ async def chat(
         learning_analysis=learning_analysis,
         guardrail_explanation=guardrail_explanation,
     )
+    # Serialize the model directly rather than letting FastAPI dump,
+    # re-validate and re-serialize it via response_model (which is kept for
+    # the OpenAPI schema)
+    return ORJSONResponse(chat_response.model_dump())
+
+
+# Priority order: critical=0, high=1, medium=2, low (or unset)=3
+QUEUE_PRIORITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
 
 
 @app.get("/moderator/queue", response_model=List[FlaggedMessage])
-async def get_moderator_queue(
+def get_moderator_queue(
     current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
 ):
     """
     Get list of flagged messages for moderator review
     Pulls from database, sorted by priority (critical > high > medium > low)
     """
-    # Get all flagged user messages that haven't been reviewed
-    # We look for user messages that are flagged, and check if they have moderator decisions
-    flagged_user_messages = (
-        db.query(Message).filter(Message.flagged, Message.role == "user").all()
-    )
-
-    result = []
-    for user_msg in flagged_user_messages:
-        # Check if this message has been reviewed
-        has_decision = (
-            db.query(ModeratorDecision)
-            .filter(ModeratorDecision.message_id == user_msg.id)
-            .first()
+    # The AI response to a user message is the next assistant message in the
+    # same conversation
+    later_ai_message = aliased(Message)
+    next_ai_message_id = (
+        select(later_ai_message.id)
+        .where(
+            later_ai_message.conversation_id == Message.conversation_id,
+            later_ai_message.role == "assistant",
+            later_ai_message.timestamp > Message.timestamp,
         )
+        .order_by(later_ai_message.timestamp, later_ai_message.id)
+        .limit(1)
+        .correlate(Message)
+        .scalar_subquery()
+    )
+    ai_message = aliased(Message)
 
-        if has_decision:
-            continue  # Skip already reviewed messages
-
-        # Get the corresponding AI response (next message in conversation)
-        ai_msg = (
-            db.query(Message)
-            .filter(
-                Message.conversation_id == user_msg.conversation_id,
-                Message.role == "assistant",
-                Message.timestamp > user_msg.timestamp,
-            )
-            .order_by(Message.timestamp)
-            .first()
-        )
+    # Sort by priority (critical first), then by timestamp (newest first)
+    # The AI message's priority wins, falling back to the user message's
+    priority_level = func.coalesce(
+        func.nullif(ai_message.priority_level, ""),
+        func.nullif(Message.priority_level, ""),
+    )
+    priority_rank = case(
+        QUEUE_PRIORITY_ORDER, value=priority_level, else_=QUEUE_PRIORITY_ORDER["low"]
+    )
 
-        conversation = (
-            db.query(Conversation)
-            .filter(Conversation.id == user_msg.conversation_id)
-            .first()
-        )
-        conversation_user = (
-            db.query(User).filter(User.id == conversation.user_id).first()
-            if conversation
-            else None
+    # Get all flagged user messages that haven't been reviewed, together with
+    # their AI response and the user who owns the conversation, in one query
+    # Messages with a moderator decision are already reviewed and left out
+    flagged_user_messages = (
+        db.query(Message, ai_message, User)
+        .select_from(Message)
+        .outerjoin(ai_message, ai_message.id == next_ai_message_id)
+        .outerjoin(Conversation, Conversation.id == Message.conversation_id)
+        .outerjoin(User, User.id == Conversation.user_id)
+        .filter(
+            Message.flagged,
+            Message.role == "user",
+            ~exists().where(ModeratorDecision.message_id == Message.id),
         )
+        .order_by(priority_rank, Message.timestamp.desc(), Message.id)
+        .all()
+    )
 
+    result = []
+    for user_msg, ai_msg, conversation_user in flagged_user_messages:
         # Get confidence score from AI message
         confidence_score = ai_msg.confidence_score if ai_msg else None
-        confidence_level = None
-        if confidence_score is not None:
-            if confidence_score >= 80:
-                confidence_level = "High"
-            elif confidence_score >= 50:
-                confidence_level = "Medium"
-            else:
-                confidence_level = "Low"
+        confidence_level = (
+            get_confidence_level(confidence_score)
+            if confidence_score is not None
+            else None
+        )
 
         # Get priority from AI message (or user message if not set)
         priority_level = (
@@ -2143,24 +2296,13 @@ async def get_moderator_queue(
             }
         )
 
-    # Priority order: critical=0, high=1, medium=2, low=3
-    priority_order = {"critical": 0, "high": 1, "medium": 2, "low": 3}
-
-    # Sort by priority (critical first), then by timestamp (newest first)
-    result.sort(
-        key=lambda x: (
-            priority_order.get(x.get("priority_level", "low"), 3),
-            -datetime.fromisoformat(x["timestamp"]).timestamp()
-            if x.get("timestamp")
-            else 0,
-        )
-    )
-
-    return result
+    # Built from our own rows with FlaggedMessage's field types, so skip
+    # response_model validation
+    return ORJSONResponse(result)
 
 
 @app.delete("/moderator/queue/{message_id}")
-async def remove_from_queue(
+def remove_from_queue(
     message_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
@@ -2189,7 +2331,7 @@ async def remove_from_queue(
 
 
 @app.post("/moderator/queue/{message_id}/action")
-async def moderator_action(
+def moderator_action(
     message_id: int,
     action_request: ModeratorActionRequest,
     current_user: User = Depends(get_current_user),
@@ -2264,84 +2406,82 @@ async def moderator_action(
         timestamp=datetime.now(timezone.utc),
     )
     db.add(decision)
+    db.flush()
+    decision_id = decision.id
     db.commit()
-    db.refresh(decision)
 
     return {
         "message": f"Action '{action_request.action}' recorded",
         "id": message_id,
-        "decision_id": decision.id,
+        "decision_id": decision_id,
         "original_response": original_response,
         "final_response": final_response,
     }
 
 
-@app.get("/confidence/examples")
-async def confidence_examples():
-    """
-    Returns sample queries with confidence scores for educational purposes
-    """
-    examples = [
-        {
-            "query": "Capital of France?",
-            "expected_confidence": 100.0,
-            "confidence_level": "High",
-            "reasons": ["Query asks for verifiable geographical fact"],
-            "category": "safe",
-        },
-        {
-            "query": "What is 2+2?",
-            "expected_confidence": 100.0,
-            "confidence_level": "High",
-            "reasons": ["Query asks for verifiable mathematical calculation"],
-            "category": "safe",
-        },
-        {
-            "query": "Who invented the telephone?",
-            "expected_confidence": 95.0,
-            "confidence_level": "High",
-            "reasons": ["Query asks for verifiable historical fact"],
-            "category": "safe",
-        },
-        {
-            "query": "Explain photosynthesis",
-            "expected_confidence": 95.0,
-            "confidence_level": "High",
-            "reasons": ["Query asks for verifiable scientific fact"],
-            "category": "safe",
-        },
-        {
-            "query": "Best programming language?",
-            "expected_confidence": 60.0,
-            "confidence_level": "Medium",
-            "reasons": ["Query requests subjective comparison or opinion"],
-            "category": "safe",
-        },
-        {
-            "query": "Should I buy a house?",
-            "expected_confidence": 30.0,
-            "confidence_level": "Low",
-            "reasons": ["Query requests personal financial advice"],
-            "category": "financial",
-        },
-        {
-            "query": "Will AI take all jobs?",
-            "expected_confidence": 40.0,
-            "confidence_level": "Low",
-            "reasons": ["Query involves future predictions with uncertainty"],
-            "category": "safe",
-        },
-        {
-            "query": "What is the weather today?",
-            "expected_confidence": 65.0,
-            "confidence_level": "Medium",
-            "reasons": ["Weather information requires current data"],
-            "category": "safe",
-        },
-    ]
-
-    return {
-        "examples": examples,
+# The examples never change, so the response body is serialized once at import
+CONFIDENCE_EXAMPLES = [
+    {
+        "query": "Capital of France?",
+        "expected_confidence": 100.0,
+        "confidence_level": "High",
+        "reasons": ["Query asks for verifiable geographical fact"],
+        "category": "safe",
+    },
+    {
+        "query": "What is 2+2?",
+        "expected_confidence": 100.0,
+        "confidence_level": "High",
+        "reasons": ["Query asks for verifiable mathematical calculation"],
+        "category": "safe",
+    },
+    {
+        "query": "Who invented the telephone?",
+        "expected_confidence": 95.0,
+        "confidence_level": "High",
+        "reasons": ["Query asks for verifiable historical fact"],
+        "category": "safe",
+    },
+    {
+        "query": "Explain photosynthesis",
+        "expected_confidence": 95.0,
+        "confidence_level": "High",
+        "reasons": ["Query asks for verifiable scientific fact"],
+        "category": "safe",
+    },
+    {
+        "query": "Best programming language?",
+        "expected_confidence": 60.0,
+        "confidence_level": "Medium",
+        "reasons": ["Query requests subjective comparison or opinion"],
+        "category": "safe",
+    },
+    {
+        "query": "Should I buy a house?",
+        "expected_confidence": 30.0,
+        "confidence_level": "Low",
+        "reasons": ["Query requests personal financial advice"],
+        "category": "financial",
+    },
+    {
+        "query": "Will AI take all jobs?",
+        "expected_confidence": 40.0,
+        "confidence_level": "Low",
+        "reasons": ["Query involves future predictions with uncertainty"],
+        "category": "safe",
+    },
+    {
+        "query": "What is the weather today?",
+        "expected_confidence": 65.0,
+        "confidence_level": "Medium",
+        "reasons": ["Weather information requires current data"],
+        "category": "safe",
+    },
+]
+
+CONFIDENCE_EXAMPLES_RESPONSE = orjson.dumps(
+    {
+        "examples": CONFIDENCE_EXAMPLES,
         "confidence_levels": {
             "High": "80-100% - Factual, well-established information",
             "Medium": "50-79% - Some uncertainty or subjective elements",
@@ -2352,18 +2492,51 @@ async def confidence_examples():
             "description": "Responses with confidence < 50% are automatically flagged for review",
         },
     }
+)
+
+
+@app.get("/confidence/examples")
+async def confidence_examples():
+    """
+    Returns sample queries with confidence scores for educational purposes
+    """
+    return Response(content=CONFIDENCE_EXAMPLES_RESPONSE, media_type="application/json")
+
+
+# Health checks are polled by monitors, so the message counts are reused for
+# a few seconds instead of being recounted on every poll
+HEALTH_COUNTS_TTL_SECONDS = 5.0
+health_counts_cache: Optional[tuple[float, tuple[int, int, int]]] = None
+health_counts_lock = threading.Lock()
 
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     """Health check endpoint"""
-    flagged_count = db.query(Message).filter(Message.flagged).count()
-    total_messages = db.query(Message).count()
-    low_confidence_count = (
-        db.query(Message)
-        .filter(Message.confidence_score < 50.0, Message.role == "assistant")
-        .count()
-    )
+    global health_counts_cache
+
+    with health_counts_lock:
+        now = time.monotonic()
+        if (
+            health_counts_cache is None
+            or now - health_counts_cache[0] >= HEALTH_COUNTS_TTL_SECONDS
+        ):
+            # All three counts in a single pass over messages
+            counts = db.query(
+                func.count(Message.id),
+                func.count(case((Message.flagged, 1))),
+                func.count(
+                    case(
+                        (
+                            (Message.role == "assistant")
+                            & (Message.confidence_score < 50.0),
+                            1,
+                        )
+                    )
+                ),
+            ).one()
+            health_counts_cache = (now, tuple(counts))
+        total_messages, flagged_count, low_confidence_count = health_counts_cache[1]
 
     return {
         "status": "healthy",
@@ -2378,4 +2551,15 @@ async def health_check(db: Session = Depends(get_db)):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvicorn picks uvloop/httptools on its own when they're installed.
+    # WEB_CONCURRENCY sets how many workers to run (default 1). A single worker
+    # runs this already-imported app; worker processes need the "app:app"
+    # import string. Each worker runs init_db() on import, so run it once
+    # before starting several (see README).
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        "app:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+    )
@@ -3,35 +3,84 @@ Authentication utilities for AI Safety Chat
 """
 
 from datetime import datetime, timedelta, timezone
-from typing import Optional
-from jose import JWTError, jwt
+from typing import Optional, Tuple
+from functools import lru_cache
+import bcrypt
+import jwt
 from passlib.context import CryptContext
 from fastapi import Depends, Cookie
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database import get_db, User
 import secrets
+import time
 
 # JWT settings
 SECRET_KEY = "your-secret-key-change-in-production"  # In production, use env variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Number of decoded tokens kept so repeat requests skip JWT verification
+TOKEN_CACHE_SIZE = 10_000
+
+# Id of the anonymous user, remembered once resolved so later requests can
+# look it up by primary key instead of by username
+anonymous_user_id: Optional[int] = None
 
 # Security scheme
 security = HTTPBearer(auto_error=False)
 
 
+# Password hashing
+# New hashes use argon2id; bcrypt hashes from before the switch still verify
+# and are upgraded to argon2 on the next successful login
+# bcrypt hashes are checked with the bcrypt module directly - passlib 1.7.4's
+# bcrypt backend fails its self-test on bcrypt>=4.1
+BCRYPT_HASH_PREFIXES = ("$2a$", "$2b$", "$2y$")
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+
+@lru_cache(maxsize=1)
+def get_pwd_context() -> CryptContext:
+    """
+    Build the password hashing context on first use, so importing the app
+    (e.g. in tests that never hash) doesn't set it up
+    Returns: The shared CryptContext
+    """
+    return CryptContext(
+        schemes=["argon2"],
+        argon2__type="ID",
+        argon2__time_cost=2,
+        argon2__memory_cost=19456,  # 19 MiB
+        argon2__parallelism=1,
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and rehash it if its hash is a legacy bcrypt hash
+    Returns: (verified, new_hash) - new_hash is None when no upgrade is needed
+    """
+    if hashed_password.startswith(BCRYPT_HASH_PREFIXES):
+        # bcrypt only ever used the first 72 bytes (passlib truncated them)
+        password_bytes = plain_password.encode()[:BCRYPT_MAX_PASSWORD_BYTES]
+        if not bcrypt.checkpw(password_bytes, hashed_password.encode()):
+            return False, None
+        return True, get_password_hash(plain_password)
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -51,8 +100,36 @@ def decode_access_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
-    except JWTError:
+    except jwt.PyJWTError:
+        return None
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def decode_token_user(token: str) -> Optional[Tuple[int, float]]:
+    """
+    Decode a token and extract who it belongs to (cached per token)
+    Returns: (user_id, expiry timestamp) or None if the token is invalid
+    """
+    payload = decode_access_token(token)
+    if not payload:
         return None
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+    return user_id, payload.get("exp", float("inf"))
+
+
+def get_token_user_id(token: str) -> Optional[int]:
+    """
+    Get the user id for a token
+    Returns: user id, or None if the token is invalid or has expired
+    """
+    token_user = decode_token_user(token)
+    # A cached token is still checked for expiry on every use
+    if token_user is None or token_user[1] <= time.time():
+        return None
+    return token_user[0]
 
 
 def get_current_user(
@@ -70,23 +147,42 @@ def get_current_user(
         token = session_token
 
     if token:
-        payload = decode_access_token(token)
-        if payload:
-            user_id = payload.get("sub")
-            if user_id:
-                user = db.query(User).filter(User.id == int(user_id)).first()
-                if user:
-                    return user
+        user_id = get_token_user_id(token)
+        if user_id is not None:
+            # Primary key lookup, served from the session's identity map if
+            # the user is already loaded
+            user = db.get(User, user_id)
+            if user:
+                return user
 
     # If no valid token, return anonymous user
+    return get_anonymous_user(db)
+
+
+def get_anonymous_user(db: Session) -> User:
+    """Get the anonymous user, creating it if it doesn't exist"""
+    global anonymous_user_id
+
+    if anonymous_user_id is not None:
+        anonymous_user = db.get(User, anonymous_user_id)
+        # The row may have been deleted (and its id reused) since the id was
+        # remembered, e.g. by reseeding the database - re-query on a miss
+        if anonymous_user and anonymous_user.username == "anonymous":
+            return anonymous_user
+
     anonymous_user = db.query(User).filter(User.username == "anonymous").first()
     if not anonymous_user:
         # Create anonymous user if it doesn't exist
-        anonymous_user = User(username="anonymous", email=None, role="user")
-        db.add(anonymous_user)
-        db.commit()
-        db.refresh(anonymous_user)
-
+        try:
+            anonymous_user = User(username="anonymous", email=None, role="user")
+            db.add(anonymous_user)
+            db.commit()
+        except IntegrityError:
+            # Another request or worker created it first
+            db.rollback()
+            anonymous_user = db.query(User).filter(User.username == "anonymous").one()
+
+    anonymous_user_id = anonymous_user.id
     return anonymous_user
 
 
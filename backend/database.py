@@ -5,6 +5,7 @@ Uses SQLAlchemy ORM with SQLite
 
 from sqlalchemy import (
     create_engine,
+    event,
     Column,
     Integer,
     String,
@@ -14,20 +15,61 @@ from sqlalchemy import (
     ForeignKey,
     Text,
     JSON,
+    Index,
+    make_url,
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.pool import StaticPool
 from datetime import datetime, timezone
+import orjson
 import os
 
 # Database URL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_safety_chat.db")
 
+# Connections are kept in a QueuePool and reused across requests instead of
+# reopening the database file (and its WAL/shared-memory files) each time.
+# An in-memory SQLite database lives in its connection, so it uses one shared
+# connection (StaticPool) that every thread sees, and pool sizing doesn't apply.
+IN_MEMORY_DATABASE = make_url(DATABASE_URL).database in (None, "", ":memory:")
+POOL_OPTIONS = (
+    {"poolclass": StaticPool}
+    if IN_MEMORY_DATABASE
+    else {"pool_size": 5, "max_overflow": 10}
+)
+
+# A database server can drop idle connections, so check and recycle pooled
+# ones. SQLite connections are local files and never go stale.
+if not DATABASE_URL.startswith("sqlite"):
+    POOL_OPTIONS.update({"pool_pre_ping": True, "pool_recycle": 1800})
+
 # Create engine
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    # JSON columns (pii_types, user_settings) are encoded with orjson
+    json_serializer=lambda value: orjson.dumps(value).decode(),
+    json_deserializer=orjson.loads,
+    **POOL_OPTIONS,
 )
 
+
+if DATABASE_URL.startswith("sqlite"):
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune each new SQLite connection for concurrent reads and cheap writes"""
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers proceed while a write is in progress
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL; fsyncs at checkpoints instead of every commit
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+        cursor.close()
+
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -58,6 +100,8 @@ class Conversation(Base):
     """Conversation model - represents a chat session"""
 
     __tablename__ = "conversations"
+    # /chat looks conversations up by session and user together
+    __table_args__ = (Index("idx_conversations_session_user", "session_id", "user_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -81,6 +125,12 @@ class Message(Base):
     """Message model - stores all chat messages"""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # Recent history of a conversation, newest first
+        Index("idx_messages_conversation_timestamp", "conversation_id", "timestamp"),
+        # Moderator queue filter
+        Index("idx_messages_flagged_role", "flagged", "role"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -115,7 +165,7 @@ class ModeratorDecision(Base):
     __tablename__ = "moderator_decisions"
 
     id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False, index=True)
     moderator_id = Column(
         Integer, ForeignKey("users.id"), nullable=True
     )  # Null for anonymous moderators
@@ -148,151 +198,67 @@ def create_tables():
     print("✅ Database tables created successfully")
 
 
-def migrate_database():
-    """Migrate existing database to add missing columns"""
-    from sqlalchemy import inspect, text
-
-    inspector = inspect(engine)
-
-    # Check if messages table exists
-    if "messages" in inspector.get_table_names():
-        # Get existing columns
-        existing_columns = [col["name"] for col in inspector.get_columns("messages")]
-
-        # Add missing columns if they don't exist
-        with engine.connect() as conn:
-            if "confidence_score" not in existing_columns:
-                conn.execute(
-                    text("ALTER TABLE messages ADD COLUMN confidence_score REAL")
-                )
-                conn.commit()
-                print("✅ Added confidence_score column to messages table")
-
-            if "confidence_level" not in existing_columns:
-                conn.execute(
-                    text("ALTER TABLE messages ADD COLUMN confidence_level VARCHAR")
-                )
-                conn.commit()
-                print("✅ Added confidence_level column to messages table")
-
-            # Note: confidence column should already exist, but check just in case
-            if "confidence" not in existing_columns:
-                conn.execute(text("ALTER TABLE messages ADD COLUMN confidence REAL"))
-                conn.commit()
-                print("✅ Added confidence column to messages table")
-
-            if "pii_detected" not in existing_columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE messages ADD COLUMN pii_detected BOOLEAN DEFAULT 0"
-                    )
-                )
-                conn.commit()
-                print("✅ Added pii_detected column to messages table")
-
-            if "pii_types" not in existing_columns:
-                # SQLite stores JSON as TEXT
-                conn.execute(text("ALTER TABLE messages ADD COLUMN pii_types TEXT"))
-                conn.commit()
-                print("✅ Added pii_types column to messages table")
-
-            # Check conversations table columns
-            conv_columns = [
-                row[1]
-                for row in conn.execute(
-                    text("PRAGMA table_info(conversations)")
-                ).fetchall()
-            ]
-            existing_conv_columns = [col.lower() for col in conv_columns]
-
-            if "learning_mode_enabled" not in existing_conv_columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE conversations ADD COLUMN learning_mode_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-                conn.commit()
-                print("✅ Added learning_mode_enabled column to conversations table")
-
-            if "user_settings" not in existing_conv_columns:
-                conn.execute(
-                    text("ALTER TABLE conversations ADD COLUMN user_settings TEXT")
-                )
-                conn.commit()
-                print("✅ Added user_settings column to conversations table")
-
-            # Check moderator_decisions table columns
-            decision_columns = [
-                row[1]
-                for row in conn.execute(
-                    text("PRAGMA table_info(moderator_decisions)")
-                ).fetchall()
-            ]
-            existing_decision_columns = [col.lower() for col in decision_columns]
-
-            if "original_response" not in existing_decision_columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE moderator_decisions ADD COLUMN original_response TEXT"
-                    )
-                )
-                conn.commit()
-                print("✅ Added original_response column to moderator_decisions table")
-
-            if "rejection_reason" not in existing_decision_columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE moderator_decisions ADD COLUMN rejection_reason VARCHAR"
-                    )
-                )
-                conn.commit()
-                print("✅ Added rejection_reason column to moderator_decisions table")
+# Columns added after the first schema: (table, column, SQL type)
+# SQLite stores JSON as TEXT
+MIGRATION_COLUMNS = [
+    ("messages", "confidence_score", "REAL"),
+    ("messages", "confidence_level", "VARCHAR"),
+    # Note: confidence column should already exist, but check just in case
+    ("messages", "confidence", "REAL"),
+    ("messages", "pii_detected", "BOOLEAN DEFAULT 0"),
+    ("messages", "pii_types", "TEXT"),
+    ("conversations", "learning_mode_enabled", "BOOLEAN DEFAULT 0"),
+    ("conversations", "user_settings", "TEXT"),
+    ("moderator_decisions", "original_response", "TEXT"),
+    ("moderator_decisions", "rejection_reason", "VARCHAR"),
+    ("moderator_decisions", "notes", "TEXT"),
+    ("moderator_decisions", "review_time_seconds", "REAL"),
+    ("messages", "priority_level", "VARCHAR"),
+    ("messages", "escalation_reason", "TEXT"),
+    ("messages", "target_response_time", "INTEGER"),
+]
+
+
+def get_table_columns(conn, table: str) -> set:
+    """
+    Read a table's columns with a single PRAGMA
+    Returns: Lowercased column names (empty if the table doesn't exist)
+    """
+    from sqlalchemy import text
+
+    return {
+        row[1].lower()
+        for row in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
+    }
 
-            if "notes" not in existing_decision_columns:
-                conn.execute(
-                    text("ALTER TABLE moderator_decisions ADD COLUMN notes TEXT")
-                )
-                conn.commit()
-                print("✅ Added notes column to moderator_decisions table")
 
-            if "review_time_seconds" not in existing_decision_columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE moderator_decisions ADD COLUMN review_time_seconds REAL"
-                    )
-                )
-                conn.commit()
-                print(
-                    "✅ Added review_time_seconds column to moderator_decisions table"
-                )
-
-            # Check messages table columns for priority fields
-            msg_columns = [
-                row[1]
-                for row in conn.execute(text("PRAGMA table_info(messages)")).fetchall()
-            ]
-            existing_msg_columns = [col.lower() for col in msg_columns]
-
-            if "priority_level" not in existing_msg_columns:
-                conn.execute(
-                    text("ALTER TABLE messages ADD COLUMN priority_level VARCHAR")
-                )
-                conn.commit()
-                print("✅ Added priority_level column to messages table")
-
-            if "escalation_reason" not in existing_msg_columns:
-                conn.execute(
-                    text("ALTER TABLE messages ADD COLUMN escalation_reason TEXT")
-                )
-                conn.commit()
-                print("✅ Added escalation_reason column to messages table")
-
-            if "target_response_time" not in existing_msg_columns:
+def migrate_database():
+    """Migrate existing database to add missing columns"""
+    from sqlalchemy import text
+
+    # Apply every change in one transaction, so SQLite commits (and syncs to
+    # disk) once instead of after each statement
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # pysqlite doesn't emit BEGIN before DDL, so open the transaction
+            # explicitly. IMMEDIATE takes the write lock up front, so processes
+            # migrating at the same time wait for each other.
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        # Get existing columns, once per table
+        existing_columns = {
+            table: get_table_columns(conn, table)
+            for table in {table for table, _, _ in MIGRATION_COLUMNS}
+        }
+
+        # Check if messages table exists
+        if existing_columns["messages"]:
+            for table, column, column_type in MIGRATION_COLUMNS:
+                if column in existing_columns[table]:
+                    continue
                 conn.execute(
-                    text("ALTER TABLE messages ADD COLUMN target_response_time INTEGER")
+                    text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
                 )
-                conn.commit()
-                print("✅ Added target_response_time column to messages table")
+                print(f"✅ Added {column} column to {table} table")
 
             # Create index on priority_level for faster sorting
             try:
@@ -301,11 +267,16 @@ def migrate_database():
                         "CREATE INDEX IF NOT EXISTS idx_messages_priority ON messages(priority_level)"
                     )
                 )
-                conn.commit()
                 print("✅ Created index on priority_level")
             except Exception as e:
                 print(f"⚠️ Index creation (may already exist): {e}")
 
+            # create_all() skips tables that already exist, so create any
+            # model indexes an older database is missing
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+
     print("✅ Database migration completed")
 
 
@@ -4,6 +4,7 @@ Creates tables and adds demo data
 """
 
 from database import init_db, SessionLocal, User, Conversation, Message
+from sqlalchemy import insert
 from datetime import datetime, timedelta, timezone
 import secrets
 
@@ -19,11 +20,19 @@ def create_demo_data():
             User(username="moderator", email="mod@example.com", role="moderator"),
         ]
 
-        for user in demo_users:
-            existing = db.query(User).filter(User.username == user.username).first()
-            if not existing:
-                db.add(user)
-                print(f"✅ Created demo user: {user.username}")
+        # Check which demo users already exist in one query
+        existing_usernames = {
+            username
+            for (username,) in db.query(User.username).filter(
+                User.username.in_([user.username for user in demo_users])
+            )
+        }
+        new_users = [
+            user for user in demo_users if user.username not in existing_usernames
+        ]
+        db.add_all(new_users)
+        for user in new_users:
+            print(f"✅ Created demo user: {user.username}")
 
         db.commit()
 
@@ -68,17 +77,24 @@ def create_demo_data():
                 },
             ]
 
-            for msg_data in demo_messages:
-                message = Message(
-                    conversation_id=conversation.id,
-                    role=msg_data["role"],
-                    content=msg_data["content"],
-                    category=msg_data["category"],
-                    flagged=msg_data.get("flagged", False),
-                    confidence=msg_data.get("confidence"),
-                    timestamp=datetime.now(timezone.utc) - timedelta(minutes=30),
-                )
-                db.add(message)
+            # Insert all messages in one executemany, skipping ORM bookkeeping
+            # Messages are a second apart so each reply sorts after its question
+            first_timestamp = datetime.now(timezone.utc) - timedelta(minutes=30)
+            db.execute(
+                insert(Message),
+                [
+                    {
+                        "conversation_id": conversation.id,
+                        "role": msg_data["role"],
+                        "content": msg_data["content"],
+                        "category": msg_data["category"],
+                        "flagged": msg_data.get("flagged", False),
+                        "confidence": msg_data.get("confidence"),
+                        "timestamp": first_timestamp + timedelta(seconds=index),
+                    }
+                    for index, msg_data in enumerate(demo_messages)
+                ],
+            )
 
             db.commit()
             print("✅ Created demo conversation and messages")
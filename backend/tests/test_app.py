@@ -5,17 +5,61 @@ import os
 # Force mock OpenAI client for tests (avoid real API calls)
 os.environ["OPENAI_API_KEY"] = ""
 
+import time
+from datetime import timedelta
+
+import bcrypt
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import (
+    analyze_conversation_context,
+    app,
+    cached_scan_message,
+    calculate_confidence_score,
+    calculate_priority,
+    check_safety_filter,
+    detect_and_redact_pii,
+    get_confidence_level,
+    MAX_MESSAGE_LENGTH,
+    SAFETY_KEYWORDS,
+    scan_message,
+    without_subsumed_keywords,
+)
+import app as app_module
+import auth
+from auth import create_access_token, get_token_user_id
+from database import Base, User, get_db
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Create a test client backed by an in-memory database, shared by the module."""
+    # StaticPool keeps the single in-memory connection, so every session (and
+    # the threadpool running sync endpoints) sees the same database
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-from app import app, check_safety_filter, SAFETY_KEYWORDS
-
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
 
-@pytest.fixture
-def client():
-    """Create a test client for the FastAPI app using fastapi.testclient."""
+    app.dependency_overrides[get_db] = override_get_db
     with TestClient(app) as test_client:
         yield test_client
+    app.dependency_overrides.clear()
+    engine.dispose()
 
 
 # --- Health Check Tests ---
@@ -44,6 +88,57 @@ def test_health_check(client):
     assert "low_confidence_responses" in data
 
 
+def test_health_check_reuses_recent_counts(client, monkeypatch):
+    """Test health polls within the TTL reuse the cached message counts."""
+    # An unbounded TTL keeps the test independent of how long requests take
+    monkeypatch.setattr(app_module, "HEALTH_COUNTS_TTL_SECONDS", float("inf"))
+    monkeypatch.setattr(app_module, "health_counts_cache", None)
+    first = client.get("/health").json()
+    client.post("/chat", json={"message": "Hello", "session_id": "health-test"})
+    second = client.get("/health").json()
+    assert second["total_messages"] == first["total_messages"]
+
+    # Once the TTL has passed, the counts are read again
+    monkeypatch.setattr(app_module, "HEALTH_COUNTS_TTL_SECONDS", 0.0)
+    third = client.get("/health").json()
+    assert third["total_messages"] == first["total_messages"] + 2
+
+
+# --- CORS Tests ---
+
+
+def test_cors_preflight_null_origin(client):
+    """Test CORS preflight succeeds for the 'null' origin (file:// frontend)."""
+    response = client.options(
+        "/chat",
+        headers={
+            "Origin": "null",
+            "Access-Control-Request-Method": "POST",
+            "Access-Control-Request-Headers": "Content-Type",
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "POST" in response.headers["access-control-allow-methods"]
+
+
+def test_cors_preflight_any_path(client):
+    """Test CORS preflight is answered for parameterized routes too."""
+    response = client.options(
+        "/moderator/queue/1",
+        headers={"Origin": "null", "Access-Control-Request-Method": "DELETE"},
+    )
+    assert response.status_code == 200
+    assert "DELETE" in response.headers["access-control-allow-methods"]
+
+
+def test_cors_headers_on_simple_request(client):
+    """Test regular responses carry the CORS allow-origin header."""
+    response = client.get("/health", headers={"Origin": "null"})
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
 # --- Chat Endpoint Tests ---
 
 
@@ -81,6 +176,15 @@ def test_chat_endpoint_whitespace_message(client):
     assert response.status_code == 400
 
 
+def test_chat_endpoint_oversized_message(client):
+    """Test chat endpoint rejects messages over the length limit."""
+    response = client.post(
+        "/chat",
+        json={"message": "a" * (MAX_MESSAGE_LENGTH + 1)},
+    )
+    assert response.status_code == 422
+
+
 def test_chat_endpoint_returns_safety_metadata(client):
     """Test chat response includes safety metadata (category, confidence, flagged)."""
     response = client.post(
@@ -143,6 +247,14 @@ def test_safety_filter_financial_keywords():
     assert 0.0 < confidence <= 1.0
 
 
+def test_safety_filter_matches_inflected_keywords():
+    """Test safety keywords match inside longer words (substring semantics)."""
+    category, _ = check_safety_filter("Are stocks a good investment?")
+    assert category == "financial"
+    category, _ = check_safety_filter("Which doctors treat headaches?")
+    assert category == "medical"
+
+
 def test_safety_filter_legal_keywords():
     """Test safety filter detects legal keywords."""
     category, confidence = check_safety_filter("I need a lawyer for a contract")
@@ -179,3 +291,257 @@ def test_safety_filter_keywords_defined():
     assert "legal" in SAFETY_KEYWORDS
     assert "crisis" in SAFETY_KEYWORDS
     assert len(SAFETY_KEYWORDS["crisis"]) > 0
+
+
+# --- Priority Tests ---
+
+
+def test_priority_crisis_category_is_critical():
+    """Test crisis category is always critical priority."""
+    priority, _, minutes = calculate_priority("crisis", 0.15, "anything")
+    assert priority == "critical"
+    assert minutes == 0
+
+
+def test_priority_crisis_keywords_without_category():
+    """Test crisis keywords escalate to critical even without a category."""
+    for keyword in SAFETY_KEYWORDS["crisis"]:
+        priority, _, _ = calculate_priority(None, 0.0, f"I feel {keyword}")
+        assert priority == "critical", f"Failed for keyword: {keyword}"
+
+
+def test_priority_medical_is_high():
+    """Test medical content gets high priority with a 5 minute target."""
+    priority, _, minutes = calculate_priority("medical", 0.8, "I have a headache")
+    assert priority == "high"
+    assert minutes == 5
+
+
+# --- PII Detection Tests ---
+
+
+def test_pii_no_pii_returns_text_unchanged():
+    """Test PII detection leaves clean text untouched."""
+    text, types, warning = detect_and_redact_pii("What is the capital of France?")
+    assert text == "What is the capital of France?"
+    assert types == []
+    assert warning == ""
+
+
+def test_pii_redacts_common_types():
+    """Test PII detection redacts credit card, SSN, phone, email and address."""
+    cases = {
+        "credit_card": "My card is 4111-1111-1111-1111",
+        "ssn": "My SSN is 123-45-6789",
+        "phone": "Call me at 555-123-4567",
+        "email": "Email me at jane.doe@example.com",
+        "address": "I live at 123 Main Street",
+    }
+    for pii_type, message in cases.items():
+        text, types, warning = detect_and_redact_pii(message)
+        assert pii_type in types, f"Failed for type: {pii_type}"
+        assert "[REDACTED]" in text
+        assert warning
+
+
+def test_pii_bare_ten_digits_require_context():
+    """Test bare 10-digit numbers are only redacted with phone context."""
+    _, types, _ = detect_and_redact_pii("Order 1234567890 shipped")
+    assert "phone" not in types
+    text, types, _ = detect_and_redact_pii("phone: 5551234567")
+    assert "phone" in types
+    assert "5551234567" not in text
+    text, _, _ = detect_and_redact_pii("Home 5550001111, mobile 5551234567")
+    assert text == "Home [REDACTED], mobile [REDACTED]"
+
+
+def test_pii_redacts_every_occurrence():
+    """Test PII detection redacts all matches in a single message."""
+    text, types, _ = detect_and_redact_pii(
+        "Cards 4111 1111 1111 1111 and 5500 0000 0000 0004, SSN 123-45-6789"
+    )
+    assert text == "Cards [REDACTED] and [REDACTED], SSN [REDACTED]"
+    assert types == ["credit_card", "ssn"]
+
+
+# --- Message Scan Cache Tests ---
+
+
+def test_cached_scan_matches_uncached_scan():
+    """Test repeated messages are served from the scan cache unchanged."""
+    message = "I need medical advice"
+    first = cached_scan_message(message)
+    hits = cached_scan_message.cache_info().hits
+    assert cached_scan_message(message) == first
+    assert cached_scan_message.cache_info().hits == hits + 1
+    assert first == scan_message(message)
+    assert first[4] == check_safety_filter(first[0])[0]
+
+
+def test_pii_message_never_cached(client):
+    """Test messages that may hold PII are scanned without the cache."""
+    before = cached_scan_message.cache_info()
+    response = client.post(
+        "/chat",
+        json={"message": "My SSN is 123-45-6789", "session_id": "pii-cache-test"},
+    )
+    assert response.status_code == 200
+    assert cached_scan_message.cache_info() == before
+
+
+def test_repeated_crisis_message_logged_every_time(client, capsys):
+    """Test crisis detection is logged even when the scan is cached."""
+    for _ in range(2):
+        client.post(
+            "/chat", json={"message": "I want to die", "session_id": "crisis-log"}
+        )
+    assert capsys.readouterr().out.count("CRISIS DETECTED") == 2
+
+
+# --- Keyword Helper Tests ---
+
+
+def test_without_subsumed_keywords():
+    """Test keywords covered by a shorter keyword are dropped, order kept."""
+    keywords = ("who invented", "will it", "invented", "will", "like", "will")
+    assert without_subsumed_keywords(keywords) == ("invented", "will", "like")
+
+
+# --- Context Analysis Tests ---
+
+
+def test_context_analysis_medical_escalation():
+    """Test medical questions escalating in severity are flagged."""
+    history = [
+        {
+            "role": "user",
+            "content": "My knee hurts",
+            "category": "medical",
+            "confidence": 0.65,
+        }
+    ]
+    analysis = analyze_conversation_context(
+        history, "Now I have chest pain and sharp pain", "medical", 0.8
+    )
+    assert analysis["risk_escalation"] is True
+    analysis = analyze_conversation_context(history, "It still hurts", "medical", 0.8)
+    assert analysis["risk_escalation"] is False
+
+
+# --- Confidence Score Tests ---
+
+
+def test_confidence_score_factual_query():
+    """Test verifiable factual queries score high confidence."""
+    score, level, reasons = calculate_confidence_score(
+        "What is the capital of France?", "Paris is the capital of France."
+    )
+    assert score == 100.0
+    assert level == "High"
+    assert "Query asks for verifiable geographical fact" in reasons
+
+
+def test_confidence_score_reasons_not_shared_between_calls():
+    """Test cached query analysis is not mutated through returned reasons."""
+    _, _, reasons = calculate_confidence_score("Should I buy stocks?", "Maybe.")
+    reasons.append("AI is uncertain about this response")
+    _, _, fresh_reasons = calculate_confidence_score("Should I buy stocks?", "Maybe.")
+    assert fresh_reasons.count("AI is uncertain about this response") == 0
+
+
+def test_confidence_level_boundaries():
+    """Test confidence levels start at 50 (Medium) and 80 (High)."""
+    assert get_confidence_level(0.0) == "Low"
+    assert get_confidence_level(49.9) == "Low"
+    assert get_confidence_level(50.0) == "Medium"
+    assert get_confidence_level(79.9) == "Medium"
+    assert get_confidence_level(80.0) == "High"
+    assert get_confidence_level(100.0) == "High"
+
+
+# --- Moderator Queue Tests ---
+
+
+def test_moderator_queue_lists_and_removes_flagged_message(client):
+    """Test flagged messages appear in the queue until reviewed."""
+    client.post("/chat", json={"message": "I want to die", "session_id": "queue-test"})
+    queue = client.get("/moderator/queue").json()
+    item = next(x for x in queue if x["user_message"] == "I want to die")
+    assert item["priority_level"] == "critical"
+    assert item["ai_response"] != "No response yet"
+    assert queue[0]["priority_level"] == "critical"
+
+    response = client.delete(f"/moderator/queue/{item['id']}")
+    assert response.status_code == 200
+    queue = client.get("/moderator/queue").json()
+    assert all(x["id"] != item["id"] for x in queue)
+
+
+# --- Auth Tests ---
+
+
+def test_cached_token_still_expires(monkeypatch):
+    """Test a decoded token stops resolving to its user once it expires."""
+    token = create_access_token({"sub": "1"}, timedelta(minutes=1))
+    assert get_token_user_id(token) == 1
+    monkeypatch.setattr(time, "time", lambda: float("inf"))
+    assert get_token_user_id(token) is None
+
+
+def test_register_then_login(client):
+    """Test a registered user can log in with their password."""
+    response = client.post(
+        "/auth/register",
+        json={"username": "login-test", "password": "correct horse"},
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        "/auth/login", json={"username": "login-test", "password": "correct horse"}
+    )
+    assert response.status_code == 200
+    assert response.json()["user"]["username"] == "login-test"
+
+    response = client.post(
+        "/auth/login", json={"username": "login-test", "password": "wrong"}
+    )
+    assert response.status_code == 401
+
+
+def test_login_upgrades_bcrypt_hash_to_argon2(client):
+    """Test a legacy bcrypt hash still logs in and is rehashed with argon2."""
+    legacy_hash = bcrypt.hashpw(b"secret123", bcrypt.gensalt(rounds=4)).decode()
+    db = next(app.dependency_overrides[get_db]())
+    db.add(User(username="bcrypt-user", password_hash=legacy_hash, role="user"))
+    db.commit()
+
+    response = client.post(
+        "/auth/login", json={"username": "bcrypt-user", "password": "secret123"}
+    )
+    assert response.status_code == 200
+
+    db.expire_all()
+    user = db.query(User).filter(User.username == "bcrypt-user").one()
+    assert user.password_hash.startswith("$argon2")
+    db.close()
+
+    response = client.post(
+        "/auth/login", json={"username": "bcrypt-user", "password": "secret123"}
+    )
+    assert response.status_code == 200
+
+
+def test_anonymous_user_requeried_when_cached_id_is_stale(monkeypatch):
+    """Test a remembered anonymous id that now belongs to another user is dropped."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        other = User(username="someone-else", email=None, role="user")
+        db.add(other)
+        db.commit()
+        monkeypatch.setattr(auth, "anonymous_user_id", other.id)
+
+        anonymous_user = auth.get_anonymous_user(db)
+        assert anonymous_user.username == "anonymous"
+        assert auth.anonymous_user_id == anonymous_user.id
+    engine.dispose()